@@ -2,16 +2,24 @@ from __future__ import annotations
 
 from flask import Flask
 
-from app.blueprints.groups import groups_blueprint
-from app.blueprints.importer import importer_blueprint
-from app.blueprints.test import test_blueprint
-from app.blueprints.types import types_blueprint
-from app.blueprints.ui import ui_blueprint
 from app.config import Config
-from app.extensions import configure_pgdb, configure_sqlalchemy, create_celery_app
+from app.extensions import (
+    configure_dedup_cache,
+    configure_pgdb,
+    configure_result_store,
+    configure_sqlalchemy,
+    create_celery_app,
+)
 
 
 def create_app(config: Config | None = None) -> Flask:
+    from app.blueprints.groups import groups_blueprint
+    from app.blueprints.importer import importer_blueprint
+    from app.blueprints.test import test_blueprint
+    from app.blueprints.types import types_blueprint
+    from app.blueprints.ui import ui_blueprint
+    from app.cli import tbc_cli
+
     app = Flask(__name__)
 
     app_config = config or Config()
@@ -20,10 +28,33 @@ def create_app(config: Config | None = None) -> Flask:
     configure_pgdb(app)
     configure_sqlalchemy(app)
     create_celery_app(app)
+    configure_result_store(app)
+    configure_dedup_cache(app)
     app.register_blueprint(ui_blueprint)
     app.register_blueprint(test_blueprint)
     app.register_blueprint(importer_blueprint)
     app.register_blueprint(groups_blueprint)
     app.register_blueprint(types_blueprint)
+    app.cli.add_command(tbc_cli)
+
+    return app
+
+
+def create_worker_app(config: Config | None = None) -> Flask:
+    """Minimal app for Celery workers: config, pgdb, Celery, result store and dedup cache.
+
+    Blueprints and the CLI are not registered; the SQLAlchemy engine is created by
+    ``get_engine``/``get_session`` on first use.
+    """
+
+    app = Flask(__name__)
+
+    app_config = config or Config()
+    app.config.from_object(app_config)
+
+    configure_pgdb(app)
+    create_celery_app(app)
+    configure_result_store(app)
+    configure_dedup_cache(app)
 
     return app
@@ -1,12 +1,38 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Any, Dict, Iterator, List, Optional
 
-from celery import states
-from flask import Blueprint, Response, current_app, jsonify, request, url_for
+from celery import group, states
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context, url_for
 
 importer_blueprint = Blueprint("importer", __name__, url_prefix="/api/importer")
 
+NDJSON_MIMETYPE = "application/x-ndjson"
+# lines per dedup cache round trip in the NDJSON stream
+NDJSON_DEDUP_BLOCK = 256
+
+
+def _validate_record(index: int, record: Any) -> Dict[str, Any]:
+    if not isinstance(record, dict):
+        raise ValueError(f"Record at index {index} must be an object")
+
+    try:
+        record_id = record["id"]
+        payload = record["payload"]
+    except KeyError as exc:  # noqa: B904
+        missing_key = exc.args[0]
+        raise ValueError(f"Record at index {index} is missing required field '{missing_key}'") from exc
+
+    if not isinstance(payload, str):
+        raise ValueError(f"Record at index {index} has invalid payload type: expected string")
+
+    return {"id": str(record_id), "payload": payload}
+
 
 def _validate_records(raw_records: Any) -> List[Dict[str, Any]]:
     if raw_records is None:
@@ -14,24 +40,19 @@ def _validate_records(raw_records: Any) -> List[Dict[str, Any]]:
     if not isinstance(raw_records, list) or not raw_records:
         raise ValueError("`records` must be a non-empty list")
 
-    validated_records: List[Dict[str, Any]] = []
-    for index, record in enumerate(raw_records):
-        if not isinstance(record, dict):
-            raise ValueError(f"Record at index {index} must be an object")
+    return [_validate_record(index, record) for index, record in enumerate(raw_records)]
 
-        try:
-            record_id = record["id"]
-            payload = record["payload"]
-        except KeyError as exc:  # noqa: B904
-            missing_key = exc.args[0]
-            raise ValueError(f"Record at index {index} is missing required field '{missing_key}'") from exc
 
-        if not isinstance(payload, str):
-            raise ValueError(f"Record at index {index} has invalid payload type: expected string")
+def _resolve_chunk_size(raw_chunk_size: Any, default: int) -> int:
+    if raw_chunk_size is None:
+        return default
+    if isinstance(raw_chunk_size, bool) or not isinstance(raw_chunk_size, int) or raw_chunk_size < 0:
+        raise ValueError("`chunk_size` must be a non-negative integer")
+    return raw_chunk_size
 
-        validated_records.append({"id": str(record_id), "payload": payload})
 
-    return validated_records
+def _chunk_records(records: List[Dict[str, Any]], chunk_size: int) -> List[List[Dict[str, Any]]]:
+    return [records[start : start + chunk_size] for start in range(0, len(records), chunk_size)]
 
 
 def _process_record(record: Dict[str, Any]) -> Dict[str, Any]:
@@ -46,8 +67,198 @@ def _process_record(record: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+def _normalize_records(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Batch form of ``_process_record``, the unit of work of one shard."""
+
+    return [_process_record(record) for record in records]
+
+
+def _iter_processed_shards(
+    records: List[Dict[str, Any]],
+    parallel_threshold: int = 0,
+    processes: Optional[int] = None,
+    shard_size: Optional[int] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Yield processed shards of ``records`` in input order.
+
+    Batches larger than ``parallel_threshold`` are spread over a process pool; smaller
+    batches, a zero threshold, or a daemonic caller (a prefork Celery child cannot
+    spawn processes) keep the work on the current process.
+    """
+
+    total = len(records)
+    parallel = (
+        bool(parallel_threshold) and total > parallel_threshold and not multiprocessing.current_process().daemon
+    )
+    if shard_size is None:
+        workers = processes or os.cpu_count() or 1
+        shard_size = -(-total // (workers * 4)) if parallel else total
+    shards = _chunk_records(records, max(1, shard_size))
+
+    if not parallel:
+        for shard in shards:
+            yield _normalize_records(shard)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        yield from executor.map(_normalize_records, shards)
+
+
+def _process_records(
+    records: List[Dict[str, Any]], parallel_threshold: int = 0, processes: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    processed: List[Dict[str, Any]] = []
+    for shard in _iter_processed_shards(records, parallel_threshold, processes):
+        processed.extend(shard)
+    return processed
+
+
+def _merge_cached(
+    keys: List[str], hits: Dict[str, Dict[str, Any]], processed: List[Dict[str, Any]], cache: Any
+) -> List[Dict[str, Any]]:
+    """Store freshly processed records in ``cache`` and interleave them with cache hits in input order."""
+
+    if processed:
+        cache.set_many(zip((key for key in keys if key not in hits), processed))
+    fresh = iter(processed)
+    return [dict(hits[key], cached=True) if key in hits else next(fresh) for key in keys]
+
+
+def _dispatch_chunks(
+    celery_app: Any,
+    process_chunk_task: Any,
+    records: List[Dict[str, Any]],
+    chunk_size: int,
+    source: str,
+    dedup_summary: Dict[str, Any],
+    cached_results: List[Dict[str, Any]],
+) -> tuple[Response, int]:
+    chunks = _chunk_records(records, chunk_size)
+    queue = celery_app.conf.task_default_queue
+    response_payload: Dict[str, Any] = {
+        "status": "queued",
+        "source": source,
+        "group_id": None,
+        "chunk_size": chunk_size,
+        "queued_tasks": len(chunks),
+        "queued_records": len(records),
+        **dedup_summary,
+    }
+    if cached_results:
+        response_payload["cached_results"] = cached_results
+    if not chunks:
+        return jsonify(response_payload), 202
+
+    group_result = group(process_chunk_task.s(chunk).set(queue=queue) for chunk in chunks).apply_async()
+    response_payload["group_id"] = group_result.id
+    if celery_app.conf.result_backend:
+        group_result.save()
+        response_payload["status_url"] = url_for("importer.group_status", group_id=group_result.id)
+
+    if group_result.ready():
+        response_payload["results"] = [
+            processed for chunk_results in group_result.get(disable_sync_subtasks=False) for processed in chunk_results
+        ]
+    return jsonify(response_payload), 202
+
+
+def _ndjson_line(item: Dict[str, Any]) -> str:
+    return json.dumps(item, separators=(",", ":")) + "\n"
+
+
+def _stream_ndjson_results(
+    stream: IO[bytes], source: str, cache: Any = None, block_size: int = NDJSON_DEDUP_BLOCK
+) -> Iterator[str]:
+    """Validate and process NDJSON records one line at a time.
+
+    Each input line yields one output line, either the processed record or an error entry
+    with the line index; a final summary line carries the totals.
+
+    With a dedup ``cache`` records are looked up and stored in blocks of ``block_size`` lines,
+    a repeated ``id`` is answered with a ``collapsed`` entry (the first payload wins, since the
+    stream cannot wait for later lines) and the summary adds ``cached``/``collapsed`` counts.
+    """
+
+    from app.dedup import split_cached
+
+    imported = 0
+    failed = 0
+    cached = 0
+    collapsed = 0
+    seen_ids: set[str] = set()
+    block: List[tuple[str, Any]] = []
+    if cache is None:
+        block_size = 1
+
+    def flush() -> Iterator[str]:
+        nonlocal cached
+        records = [value for kind, value in block if kind == "record"]
+        if cache is None:
+            results = iter([_process_record(record) for record in records])
+        else:
+            keys, hits, misses = split_cached(records, cache)
+            cached += len(hits)
+            results = iter(_merge_cached(keys, hits, [_process_record(record) for record in misses], cache))
+        for kind, value in block:
+            yield _ndjson_line(next(results)) if kind == "record" else value
+        block.clear()
+
+    index = -1
+    for raw_line in stream:
+        if not raw_line.strip():
+            continue
+        index += 1
+        try:
+            try:
+                record = json.loads(raw_line)
+            except ValueError as exc:
+                raise ValueError(f"Record at index {index} is not valid JSON: {exc}") from exc
+            record = _validate_record(index, record)
+        except ValueError as exc:
+            failed += 1
+            block.append(("line", _ndjson_line({"status": "error", "index": index, "message": str(exc)})))
+        else:
+            if cache is not None and record["id"] in seen_ids:
+                collapsed += 1
+                block.append(("line", _ndjson_line({"status": "collapsed", "index": index, "id": record["id"]})))
+            else:
+                imported += 1
+                if cache is not None:
+                    seen_ids.add(record["id"])
+                block.append(("record", record))
+        if len(block) >= block_size:
+            yield from flush()
+    if block:
+        yield from flush()
+
+    if index < 0:
+        yield _ndjson_line({"status": "error", "source": source, "message": "`records` must be a non-empty list"})
+        return
+    summary: Dict[str, Any] = {
+        "status": "ok" if not failed else "partial",
+        "source": source,
+        "imported": imported,
+        "failed": failed,
+    }
+    if cache is not None:
+        summary.update(collapsed=collapsed, cached=cached)
+    yield _ndjson_line(summary)
+
+
+def _ingest_ndjson() -> Response:
+    from app.extensions import get_dedup_cache
+
+    source = request.args.get("source", "unspecified")
+    stream = request.stream
+    cache = get_dedup_cache(current_app)
+    return Response(stream_with_context(_stream_ndjson_results(stream, source, cache)), mimetype=NDJSON_MIMETYPE)
+
+
 @importer_blueprint.route("/ingest", methods=["POST"])
 def ingest_records() -> tuple[Response, int]:
+    if request.mimetype == NDJSON_MIMETYPE:
+        return _ingest_ndjson(), 200
+
     payload = request.get_json(silent=True)
     if payload is None:
         return jsonify({"status": "error", "message": "Request body must be valid JSON"}), 400
@@ -60,22 +271,46 @@ def ingest_records() -> tuple[Response, int]:
 
     try:
         records = _validate_records(payload.get("records"))
+        chunk_size = _resolve_chunk_size(
+            payload.get("chunk_size"), current_app.config["CELERY_CONFIG"].ingest_chunk_size
+        )
     except ValueError as exc:
         current_app.logger.warning("Importer validation failed: %s", exc)
         return jsonify({"status": "error", "message": str(exc)}), 400
 
+    from app.dedup import collapse_duplicate_ids, split_cached
+    from app.extensions import get_dedup_cache
+
+    cache = get_dedup_cache(current_app)
+    dedup_summary: Dict[str, Any] = {}
+    keys: List[str] = []
+    hits: Dict[str, Dict[str, Any]] = {}
+    pending_records = records
+    if cache is not None:
+        unique_records = collapse_duplicate_ids(records)
+        keys, hits, pending_records = split_cached(unique_records, cache)
+        dedup_summary["collapsed"] = len(records) - len(unique_records)
+        dedup_summary["cached"] = len(hits)
+
     if enqueue_tasks:
         try:
             from app.extensions import get_celery_app
 
             celery_app = get_celery_app(current_app)
             process_task = celery_app.tasks["app.tasks.importer.process_record_task"]
+            process_chunk_task = celery_app.tasks["app.tasks.importer.process_records_task"]
         except Exception as exc:  # noqa: BLE001
             current_app.logger.error("Celery dispatch failed: %s", exc)
             return jsonify({"status": "error", "message": "Celery is not configured"}), 503
 
-        tasks = []
-        for record in records:
+        cached_results = [dict(hits[key], cached=True) for key in keys if key in hits]
+        if chunk_size:
+            return _dispatch_chunks(
+                celery_app, process_chunk_task, pending_records, chunk_size, source, dedup_summary, cached_results
+            )
+
+        tasks = [{"record_id": result["id"], "cached": True, "result": result} for result in cached_results]
+        for record in pending_records:
             async_result = process_task.apply_async(args=[record], queue=celery_app.conf.task_default_queue)
             task_payload = {"record_id": record["id"], "task_id": async_result.id}
             if async_result.ready():
@@ -87,14 +322,19 @@ def ingest_records() -> tuple[Response, int]:
                 {
                     "status": "queued",
                     "source": source,
-                    "queued_tasks": len(tasks),
+                    "queued_tasks": len(pending_records),
                     "tasks": tasks,
+                    **dedup_summary,
                 }
             ),
             202,
         )
 
-    processed_records = [_process_record(record) for record in records]
+    processed_records = _process_records(
+        pending_records, current_app.config["IMPORTER_PARALLEL_THRESHOLD"], current_app.config["IMPORTER_PROCESSES"]
+    )
+    if cache is not None:
+        processed_records = _merge_cached(keys, hits, processed_records, cache)
 
     return (
         jsonify(
@@ -103,6 +343,7 @@ def ingest_records() -> tuple[Response, int]:
                 "source": source,
                 "imported": len(processed_records),
                 "results": processed_records,
+                **dedup_summary,
             }
         ),
         200,
@@ -146,6 +387,30 @@ def enqueue_progress_import() -> tuple[Response, int]:
     return jsonify(response_payload), 202
 
 
+def _task_payload(task_id: str, async_result: Any) -> Dict[str, Any]:
+    response_payload: Dict[str, Any] = {"task_id": task_id, "state": async_result.state}
+
+    if async_result.info:
+        if isinstance(async_result.info, dict):
+            response_payload["meta"] = async_result.info
+        else:
+            response_payload["meta"] = {"details": str(async_result.info)}
+
+    if async_result.successful():
+        response_payload["result"] = async_result.result
+    elif async_result.state == states.FAILURE:
+        response_payload["error"] = str(async_result.result)
+
+    return response_payload
+
+
+def _stored_result_ref(async_result: Any) -> Optional[Dict[str, Any]]:
+    if not async_result.successful() or not isinstance(async_result.result, dict):
+        return None
+    result_ref = async_result.result.get("result_ref")
+    return result_ref if isinstance(result_ref, dict) else None
+
+
 @importer_blueprint.route("/status/<task_id>", methods=["GET"])
 def task_status(task_id: str) -> tuple[Response, int]:
     try:
@@ -157,19 +422,131 @@ def task_status(task_id: str) -> tuple[Response, int]:
         return jsonify({"status": "error", "message": "Celery is not configured"}), 503
 
     async_result = celery_app.AsyncResult(task_id)
-    response_payload: Dict[str, Any] = {"task_id": task_id, "state": async_result.state}
-
-    if async_result.info:
-        if isinstance(async_result.info, dict):
-            response_payload["meta"] = async_result.info
-        else:
-            response_payload["meta"] = {"details": str(async_result.info)}
+    response_payload = _task_payload(task_id, async_result)
+    result_ref = _stored_result_ref(async_result)
+    if result_ref is None:
+        return jsonify(response_payload), 200
 
-    if async_result.successful():
-        response_payload["result"] = async_result.result
+    response_payload["result_url"] = url_for("importer.task_status", task_id=task_id, result=1)
+    if request.args.get("result", 0, type=int) != 1:
         return jsonify(response_payload), 200
 
-    if async_result.state == states.FAILURE:
-        response_payload["error"] = str(async_result.result)
+    from app.extensions import get_result_store
+    from app.result_store import iter_stored_result
+
+    store = get_result_store(current_app)
+    if store is None or store.kind != result_ref.get("store"):
+        return jsonify({"status": "error", "message": "Result store is not configured"}), 503
+    try:
+        stored = store.open(result_ref["key"])
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": "Stored result has expired"}), 410
+
+    envelope = json.dumps({"task_id": task_id, "state": async_result.state, "result_ref": result_ref})
 
+    def generate() -> Iterator[bytes]:
+        yield envelope[:-1].encode() + b', "result": '
+        yield from iter_stored_result(stored)
+        yield b"}"
+
+    return Response(generate(), mimetype="application/json"), 200
+
+
+@importer_blueprint.route("/status/group/<group_id>", methods=["GET"])
+def group_status(group_id: str) -> tuple[Response, int]:
+    try:
+        from app.extensions import get_celery_app
+
+        celery_app = get_celery_app(current_app)
+    except Exception as exc:  # noqa: BLE001
+        current_app.logger.error("Celery lookup failed: %s", exc)
+        return jsonify({"status": "error", "message": "Celery is not configured"}), 503
+
+    group_result = celery_app.GroupResult.restore(group_id)
+    if group_result is None:
+        return jsonify({"status": "error", "message": f"Unknown group: {group_id}"}), 404
+
+    chunk_results = list(group_result.results)
+    errors = [
+        {"task_id": chunk_result.id, "error": str(chunk_result.result)}
+        for chunk_result in chunk_results
+        if chunk_result.state == states.FAILURE
+    ]
+    completed = group_result.completed_count()
+    ready = completed + len(errors) == len(chunk_results)
+    if errors:
+        state = states.FAILURE if ready else states.STARTED
+    elif ready:
+        state = states.SUCCESS
+    else:
+        state = states.STARTED if completed else states.PENDING
+
+    response_payload: Dict[str, Any] = {
+        "group_id": group_id,
+        "state": state,
+        "total_tasks": len(chunk_results),
+        "completed_tasks": completed,
+        "failed_tasks": len(errors),
+    }
+    if errors:
+        response_payload["errors"] = errors
+    elif ready:
+        response_payload["results"] = [
+            processed for chunk_result in chunk_results for processed in chunk_result.result
+        ]
     return jsonify(response_payload), 200
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def _stream_task_events(
+    celery_app: Any, task_id: str, interval: float, timeout: float, keepalive: float = 15.0
+) -> Iterator[str]:
+    """Poll the result backend once per ``interval`` and emit an SSE event only when the
+    task state or progress changes; the stream ends when the task is ready or after ``timeout``."""
+
+    started = time.monotonic()
+    last_payload: Optional[Dict[str, Any]] = None
+    last_sent = started
+    while True:
+        async_result = celery_app.AsyncResult(task_id)
+        payload = _task_payload(task_id, async_result)
+        now = time.monotonic()
+        if payload != last_payload:
+            yield _sse_event("state", payload)
+            last_payload = payload
+            last_sent = now
+        elif now - last_sent >= keepalive:
+            yield ": keep-alive\n\n"
+            last_sent = now
+
+        if async_result.state in states.READY_STATES:
+            return
+        if now - started >= timeout:
+            yield _sse_event("timeout", {"task_id": task_id, "state": async_result.state})
+            return
+        time.sleep(interval)
+
+
+@importer_blueprint.route("/status/<task_id>/stream", methods=["GET"])
+def task_status_stream(task_id: str) -> tuple[Response, int]:
+    try:
+        from app.extensions import get_celery_app
+
+        celery_app = get_celery_app(current_app)
+    except Exception as exc:  # noqa: BLE001
+        current_app.logger.error("Celery lookup failed: %s", exc)
+        return jsonify({"status": "error", "message": "Celery is not configured"}), 503
+
+    celery_config = current_app.config["CELERY_CONFIG"]
+    interval = max(request.args.get("interval", 1.0, type=float), celery_config.stream_min_interval)
+    timeout = request.args.get("timeout", celery_config.stream_max_timeout, type=float)
+    timeout = min(max(timeout, 0.0), celery_config.stream_max_timeout)
+    response = Response(
+        _stream_task_events(celery_app, task_id, interval, timeout), mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response, 200
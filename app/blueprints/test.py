@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from flask import Blueprint, Response, current_app, jsonify
+from flask import Blueprint, Response, current_app, jsonify, request
 
 from app.extensions import get_db_factory
 
@@ -25,3 +25,23 @@ def database_status() -> tuple[Response, int] | Response:
         return jsonify({"status": "error", "message": "Database unavailable"}), 503
 
     return jsonify({"status": "ok", "postgres_version": version})
+
+
+@test_blueprint.route("/db-metrics", methods=["GET"])
+def database_metrics() -> tuple[Response, int] | Response:
+    try:
+        db_factory = get_db_factory(current_app)
+    except Exception as exc:  # noqa: BLE001
+        current_app.logger.warning("Database factory lookup failed: %s", exc)
+        return jsonify({"status": "error", "message": "Database is not configured"}), 503
+
+    stats = db_factory.STATS
+    if stats is None:
+        return jsonify({"status": "disabled", "queries": []})
+
+    limit = request.args.get("limit", type=int)
+    queries = stats.snapshot(limit=limit)
+    if request.args.get("reset", type=int):
+        stats.reset()
+
+    return jsonify({"status": "ok", "slow_query_ms": db_factory.SLOW_QUERY_MS, "queries": queries})
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.extensions import get_db_factory
+
+tbc_cli = AppGroup("tbc", help="Book storage maintenance commands.")
+
+CHECKPOINT_NAME = ".tbc_ingest.checkpoint"
+
+_worker_db: Any = None
+_worker_tbc: Any = None
+_worker_error: Optional[str] = None
+
+
+def _scan(directory: str, skip: Set[str]) -> Iterator[str]:
+    """Yield files under ``directory`` lazily, depth-first, without building a full listing."""
+
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError as exc:
+            click.echo(f"skip {current}: {exc}", err=True)
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    if entry.name == CHECKPOINT_NAME or entry.path in skip:
+                        continue
+                    yield entry.path
+
+
+def _chunks(paths: Iterator[str], size: int, counter: Dict[str, int]) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for path in paths:
+        counter["scanned"] += 1
+        chunk.append(path)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+    counter["scan_done"] = 1
+
+
+def _load_checkpoint(path: str) -> Set[str]:
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as checkpoint:
+        return {line.rstrip("\n") for line in checkpoint if line.strip()}
+
+
+class WorkerSetupError(RuntimeError):
+    pass
+
+
+def _init_worker(db_factory: Any, connection_settings: Dict[str, Any]) -> None:
+    # An exception here would make multiprocessing.Pool respawn the worker forever;
+    # remember it instead and fail the first batch so the parent can abort the run.
+    global _worker_db, _worker_tbc, _worker_error
+
+    try:
+        for name, value in connection_settings.items():
+            setattr(db_factory, name, value)
+        from libs.tbc_class import TBC
+
+        _worker_db = db_factory()
+        _worker_tbc = TBC(_worker_db)
+    except Exception as exc:  # noqa: BLE001
+        _worker_error = f"{type(exc).__name__}: {exc}"
+
+
+def _ingest_batch(job: tuple[List[str], str]) -> List[tuple[str, str, Optional[str]]]:
+    if _worker_error is not None:
+        raise WorkerSetupError(_worker_error)
+    paths, import_type = job
+    params = [{"import_file": path, "import_type": import_type} for path in paths]
+    try:
+        report = _worker_tbc.import_files(params, lang_processes=1, hash_processes=1)
+    except Exception as exc:  # noqa: BLE001
+        _worker_db.rollback()
+        return [(path, "error", str(exc)) for path in paths]
+    return [(path, entry["status"], entry.get("error")) for path, entry in zip(paths, report)]
+
+
+def _preflight(db_factory: Any) -> None:
+    """Fail fast in the parent on the errors every worker would hit during setup."""
+
+    try:
+        import libs.tbc_class  # noqa: F401
+
+        db_factory().close()
+    except Exception as exc:  # noqa: BLE001
+        raise click.ClickException(f"ingest setup failed: {type(exc).__name__}: {exc}") from exc
+
+
+def _record_results(
+    results: List[tuple[str, str, Optional[str]]], totals: Dict[str, int], checkpoint_file: Any
+) -> None:
+    for path, status, error in results:
+        totals[status if status in totals else "error"] += 1
+        if status in ("ok", "duplicate"):
+            checkpoint_file.write(path + "\n")
+        elif error:
+            click.echo(f"error {path}: {error}", err=True)
+    checkpoint_file.flush()
+
+
+def _format_eta(seconds: float | None) -> str:
+    if seconds is None:
+        return "?"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{secs:02d}"
+
+
+@tbc_cli.command("ingest")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False, resolve_path=True))
+@click.option("--workers", "-w", default=os.cpu_count() or 1, show_default=True, help="Importer processes.")
+@click.option("--batch-size", default=100, show_default=True, help="Files per TBC.import_files call.")
+@click.option(
+    "--import-type", type=click.Choice(["move", "copy"]), default="move", show_default=True
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help=f"Checkpoint file with finished paths (default: DIRECTORY/{CHECKPOINT_NAME}).",
+)
+def ingest(directory: str, workers: int, batch_size: int, import_type: str, checkpoint: str | None) -> None:
+    """Import every file under DIRECTORY into book storage.
+
+    Files are hashed and deduplicated against ``books.md5`` by the workers; imported and
+    duplicate paths are appended to the checkpoint so an interrupted run can be resumed.
+    """
+
+    checkpoint_path = checkpoint or os.path.join(directory, CHECKPOINT_NAME)
+    finished = _load_checkpoint(checkpoint_path)
+    if finished:
+        click.echo(f"resuming: {len(finished)} files already done", err=True)
+
+    db_factory = get_db_factory(current_app)
+    connection_settings = {
+        name: getattr(db_factory, name)
+        for name in ("PG_HOST", "PG_PORT", "PG_USER", "PG_PASSWORD", "PG_DB", "PREPARE_STATEMENTS")
+    }
+    counter = {"scanned": 0, "scan_done": 0}
+    totals = {"ok": 0, "duplicate": 0, "error": 0}
+    chunks = _chunks(_scan(directory, finished), batch_size, counter)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        click.echo("0 files to import")
+        return
+    _preflight(db_factory)
+
+    def jobs() -> Iterator[tuple[List[str], str]]:
+        yield first_chunk, import_type
+        for chunk in chunks:
+            yield chunk, import_type
+
+    started = time.monotonic()
+    context = multiprocessing.get_context()
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint_file, context.Pool(
+        processes=workers, initializer=_init_worker, initargs=(db_factory, connection_settings)
+    ) as pool:
+        try:
+            for results in pool.imap_unordered(_ingest_batch, jobs()):
+                _record_results(results, totals, checkpoint_file)
+
+                done = sum(totals.values())
+                elapsed = time.monotonic() - started
+                rate = done / elapsed if elapsed > 0 else 0.0
+                eta = (counter["scanned"] - done) / rate if counter["scan_done"] and rate else None
+                click.echo(
+                    f"{done}/{counter['scanned']}{'' if counter['scan_done'] else '+'} files, "
+                    f"{rate:.1f} files/s, ok={totals['ok']} duplicate={totals['duplicate']} "
+                    f"error={totals['error']}, ETA {_format_eta(eta)}",
+                    err=True,
+                )
+        except WorkerSetupError as exc:
+            raise click.ClickException(f"ingest worker setup failed: {exc}") from exc
+
+    click.echo(
+        f"imported {totals['ok']}, duplicates {totals['duplicate']}, errors {totals['error']} "
+        f"in {_format_eta(time.monotonic() - started)}"
+    )
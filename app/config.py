@@ -11,6 +11,14 @@ class PostgresConfig:
     user: str = "tbc"
     password: str = "tbcpass"
     database: str = "books"
+    pool_enabled: bool = False
+    pool_min_size: int = 1
+    pool_max_size: int = 10
+    pool_timeout: float = 30.0
+    pool_check_interval: float = 10.0
+    prepare_statements: bool = False
+    query_stats_enabled: bool = True
+    slow_query_ms: float | None = None
 
     @classmethod
     def from_environ(cls) -> "PostgresConfig":
@@ -20,6 +28,18 @@ class PostgresConfig:
             user=os.getenv("POSTGRES_USER", cls.user),
             password=os.getenv("POSTGRES_PASSWORD", cls.password),
             database=os.getenv("POSTGRES_DB", cls.database),
+            pool_enabled=bool(int(os.getenv("POSTGRES_POOL_ENABLED", str(int(cls.pool_enabled))))),
+            pool_min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", cls.pool_min_size)),
+            pool_max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", cls.pool_max_size)),
+            pool_timeout=float(os.getenv("POSTGRES_POOL_TIMEOUT", cls.pool_timeout)),
+            pool_check_interval=float(os.getenv("POSTGRES_POOL_CHECK_INTERVAL", cls.pool_check_interval)),
+            prepare_statements=bool(
+                int(os.getenv("POSTGRES_PREPARE_STATEMENTS", str(int(cls.prepare_statements))))
+            ),
+            query_stats_enabled=bool(
+                int(os.getenv("POSTGRES_QUERY_STATS_ENABLED", str(int(cls.query_stats_enabled))))
+            ),
+            slow_query_ms=float(os.environ["POSTGRES_SLOW_QUERY_MS"]) if os.getenv("POSTGRES_SLOW_QUERY_MS") else None,
         )
 
 
@@ -33,6 +53,16 @@ class CeleryConfig:
     task_always_eager: bool = False
     task_eager_propagates: bool = True
     task_store_eager_result: bool = False
+    ingest_chunk_size: int = 0
+    progress_every_records: int = 500
+    progress_interval: float = 1.0
+    stream_min_interval: float = 1.0
+    stream_max_timeout: float = 300.0
+    result_store: str | None = None
+    result_store_dir: str = "/tmp/tbc_results"
+    result_store_threshold: int = 1000
+    result_store_ttl: float = 86400.0
+    result_store_purge_interval: float = 3600.0
 
     @staticmethod
     def _validated_broker_url(raw_url: str) -> str:
@@ -56,6 +86,18 @@ class CeleryConfig:
             task_store_eager_result=bool(
                 int(os.getenv("CELERY_TASK_STORE_EAGER_RESULT", str(int(cls.task_store_eager_result))))
             ),
+            ingest_chunk_size=int(os.getenv("CELERY_INGEST_CHUNK_SIZE", cls.ingest_chunk_size)),
+            progress_every_records=int(os.getenv("CELERY_PROGRESS_EVERY_RECORDS", cls.progress_every_records)),
+            progress_interval=float(os.getenv("CELERY_PROGRESS_INTERVAL", cls.progress_interval)),
+            stream_min_interval=float(os.getenv("CELERY_STREAM_MIN_INTERVAL", cls.stream_min_interval)),
+            stream_max_timeout=float(os.getenv("CELERY_STREAM_MAX_TIMEOUT", cls.stream_max_timeout)),
+            result_store=os.getenv("CELERY_RESULT_STORE", cls.result_store) or None,
+            result_store_dir=os.getenv("CELERY_RESULT_STORE_DIR", cls.result_store_dir),
+            result_store_threshold=int(os.getenv("CELERY_RESULT_STORE_THRESHOLD", cls.result_store_threshold)),
+            result_store_ttl=float(os.getenv("CELERY_RESULT_STORE_TTL", cls.result_store_ttl)),
+            result_store_purge_interval=float(
+                os.getenv("CELERY_RESULT_STORE_PURGE_INTERVAL", cls.result_store_purge_interval)
+            ),
         )
 
 
@@ -65,3 +107,9 @@ class Config:
     POSTGRES_CONFIG = PostgresConfig.from_environ()
     CELERY_CONFIG = CeleryConfig.from_environ()
     SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
+    IMPORTER_PARALLEL_THRESHOLD = int(os.getenv("IMPORTER_PARALLEL_THRESHOLD", "0"))
+    IMPORTER_PROCESSES = int(os.getenv("IMPORTER_PROCESSES", "0")) or None
+    IMPORTER_DEDUP_ENABLED = bool(int(os.getenv("IMPORTER_DEDUP_ENABLED", "0")))
+    IMPORTER_DEDUP_TTL = float(os.getenv("IMPORTER_DEDUP_TTL", "600"))
+    IMPORTER_DEDUP_MAX_ENTRIES = int(os.getenv("IMPORTER_DEDUP_MAX_ENTRIES", "100000"))
+    IMPORTER_DEDUP_REDIS_URL = os.getenv("IMPORTER_DEDUP_REDIS_URL")
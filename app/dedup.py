@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def dedup_key(record: Dict[str, Any]) -> str:
+    """Cache key of a validated record: its id plus a digest of its payload."""
+
+    digest = hashlib.blake2b(record["payload"].encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+    return f"{record['id']}:{digest}"
+
+
+class LocalDedupCache:
+    """Thread-safe in-process LRU of processed records with a per-entry TTL."""
+
+    def __init__(self, max_entries: int = 100_000, ttl: float = 600.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, Tuple[float, Dict[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        hits: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                hits[key] = entry[1]
+        return hits
+
+    def set_many(self, items: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in items:
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisDedupCache:
+    """Redis-shared dedup cache in front of which sits a ``LocalDedupCache``.
+
+    Redis errors are logged and treated as misses: the cache only saves work, so an
+    unavailable Redis must not fail an import.
+    """
+
+    def __init__(self, client: Any, local: LocalDedupCache, prefix: str = "importer:dedup:") -> None:
+        self.client = client
+        self.local = local
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, local: LocalDedupCache) -> "RedisDedupCache":
+        import redis
+
+        return cls(redis.Redis.from_url(url), local)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        hits = self.local.get_many(keys)
+        missing = [key for key in keys if key not in hits]
+        if not missing:
+            return hits
+        try:
+            values = self.client.mget([self.prefix + key for key in missing])
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Dedup cache lookup failed: %s", exc)
+            return hits
+        shared = {key: json.loads(value) for key, value in zip(missing, values) if value is not None}
+        if shared:
+            self.local.set_many(shared.items())
+            hits.update(shared)
+        return hits
+
+    def set_many(self, items: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        items = list(items)
+        self.local.set_many(items)
+        if not items:
+            return
+        ttl = max(1, int(self.local.ttl))
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, value in items:
+                pipeline.set(self.prefix + key, json.dumps(value, separators=(",", ":")), ex=ttl)
+            pipeline.execute()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Dedup cache update failed: %s", exc)
+
+    def clear(self) -> None:
+        self.local.clear()
+
+
+def collapse_duplicate_ids(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keep one record per id: the last payload wins, the first position is kept."""
+
+    unique: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        unique[record["id"]] = record
+    return list(unique.values())
+
+
+def split_cached(
+    records: List[Dict[str, Any]], cache: Any
+) -> Tuple[List[str], Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """Return record keys, cache hits by key and the records that still need processing."""
+
+    keys = [dedup_key(record) for record in records]
+    hits = cache.get_many(keys)
+    misses = [record for record, key in zip(records, keys) if key not in hits]
+    return keys, hits, misses
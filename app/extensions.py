@@ -1,15 +1,23 @@
 from __future__ import annotations
 
-from typing import Any
+import threading
+from typing import TYPE_CHECKING, Any
 
 from celery import Celery
 from flask import Flask
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine, URL
-from sqlalchemy.orm import Session, sessionmaker
 
 from app.config import CeleryConfig, PostgresConfig
-from libs.pgdb_class import pgdb
+from app.dedup import LocalDedupCache, RedisDedupCache
+from app.result_store import FileResultStore, PostgresResultStore
+from libs.pgdb_class import pgdb, query_stats
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import URL, Engine
+    from sqlalchemy.orm import Session
+
+# SQLAlchemy is imported on first use so that Celery workers, which never touch the ORM,
+# do not pay for it at boot.
+_sqlalchemy_lock = threading.Lock()
 
 
 def configure_pgdb(app: Flask) -> None:
@@ -22,6 +30,22 @@ def configure_pgdb(app: Flask) -> None:
     pgdb.PG_USER = postgres_config.user
     pgdb.PG_PASSWORD = postgres_config.password
     pgdb.PG_DB = postgres_config.database
+    pgdb.PREPARE_STATEMENTS = postgres_config.prepare_statements
+    pgdb.SLOW_QUERY_MS = postgres_config.slow_query_ms
+    if postgres_config.query_stats_enabled:
+        pgdb.STATS = pgdb.STATS or query_stats()
+    else:
+        pgdb.STATS = None
+
+    if postgres_config.pool_enabled:
+        pgdb.configure_pool(
+            minconn=postgres_config.pool_min_size,
+            maxconn=postgres_config.pool_max_size,
+            timeout=postgres_config.pool_timeout,
+            check_interval=postgres_config.pool_check_interval,
+        )
+    else:
+        pgdb.close_pool()
 
     app.extensions["pgdb_factory"] = pgdb
 
@@ -35,7 +59,7 @@ def get_db_factory(app: Flask) -> type[pgdb]:
     return factory
 
 
-def _build_sqlalchemy_url(app: Flask) -> str:
+def _build_sqlalchemy_url(app: Flask) -> str | URL:
     postgres_config: PostgresConfig | None = app.config.get("POSTGRES_CONFIG")
     if not isinstance(postgres_config, PostgresConfig):
         raise TypeError("POSTGRES_CONFIG must be a PostgresConfig instance")
@@ -44,6 +68,8 @@ def _build_sqlalchemy_url(app: Flask) -> str:
     if override_uri:
         return override_uri
 
+    from sqlalchemy.engine import URL
+
     url = URL.create(
         "postgresql+psycopg2",
         username=postgres_config.user or None,
@@ -56,6 +82,9 @@ def _build_sqlalchemy_url(app: Flask) -> str:
 
 
 def configure_sqlalchemy(app: Flask) -> None:
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
     sqlalchemy_url = _build_sqlalchemy_url(app)
     engine = create_engine(sqlalchemy_url, future=True)
     session_factory = sessionmaker(
@@ -65,7 +94,18 @@ def configure_sqlalchemy(app: Flask) -> None:
     app.extensions["sa_sessionmaker"] = session_factory
 
 
+def _ensure_sqlalchemy(app: Flask) -> None:
+    if "sa_engine" in app.extensions:
+        return
+    with _sqlalchemy_lock:
+        if "sa_engine" not in app.extensions:
+            configure_sqlalchemy(app)
+
+
 def get_engine(app: Flask) -> Engine:
+    from sqlalchemy.engine import Engine
+
+    _ensure_sqlalchemy(app)
     engine: Any = app.extensions.get("sa_engine")
     if engine is None:
         raise LookupError("SQLAlchemy engine is not configured. Call configure_sqlalchemy first.")
@@ -75,6 +115,7 @@ def get_engine(app: Flask) -> Engine:
 
 
 def get_session(app: Flask) -> Session:
+    _ensure_sqlalchemy(app)
     session_factory: Any = app.extensions.get("sa_sessionmaker")
     if session_factory is None:
         raise LookupError("Session factory is not configured. Call configure_sqlalchemy first.")
@@ -127,3 +168,43 @@ def get_celery_app(app: Flask) -> Celery:
     if not isinstance(celery_app, Celery):
         raise TypeError("Configured Celery application is invalid")
     return celery_app
+
+
+def configure_result_store(app: Flask) -> None:
+    celery_config: CeleryConfig | None = app.config.get("CELERY_CONFIG")
+    if not isinstance(celery_config, CeleryConfig):
+        raise TypeError("CELERY_CONFIG must be a CeleryConfig instance")
+
+    store: FileResultStore | PostgresResultStore | None
+    expiry = {"ttl": celery_config.result_store_ttl, "purge_interval": celery_config.result_store_purge_interval}
+    if celery_config.result_store is None:
+        store = None
+    elif celery_config.result_store == "file":
+        store = FileResultStore(celery_config.result_store_dir, **expiry)
+    elif celery_config.result_store == "postgres":
+        store = PostgresResultStore(get_db_factory(app), **expiry)
+    else:
+        raise ValueError("CELERY_RESULT_STORE must be 'file' or 'postgres'")
+
+    app.extensions["result_store"] = store
+
+
+def get_result_store(app: Flask) -> FileResultStore | PostgresResultStore | None:
+    return app.extensions.get("result_store")
+
+
+def configure_dedup_cache(app: Flask) -> None:
+    cache: LocalDedupCache | RedisDedupCache | None = None
+    if app.config.get("IMPORTER_DEDUP_ENABLED"):
+        cache = LocalDedupCache(
+            max_entries=app.config["IMPORTER_DEDUP_MAX_ENTRIES"], ttl=app.config["IMPORTER_DEDUP_TTL"]
+        )
+        redis_url: str | None = app.config.get("IMPORTER_DEDUP_REDIS_URL")
+        if redis_url:
+            cache = RedisDedupCache.from_url(redis_url, cache)
+
+    app.extensions["dedup_cache"] = cache
+
+
+def get_dedup_cache(app: Flask) -> LocalDedupCache | RedisDedupCache | None:
+    return app.extensions.get("dedup_cache")
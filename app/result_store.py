@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import gzip
+from abc import ABC, abstractmethod
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import IO, Any, Dict, Iterator
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def _validated_key(key: str) -> str:
+    if not _KEY_PATTERN.match(key) or key.startswith("."):
+        raise ValueError(f"Invalid result key: {key!r}")
+    return key
+
+
+class _ExpiringResultStore(ABC):
+    """Expiry shared by the stores: ``save`` purges results older than ``ttl`` seconds at most
+    once per ``purge_interval``; a ``ttl`` of 0 keeps results forever."""
+
+    def __init__(self, ttl: float = 0.0, purge_interval: float = 3600.0) -> None:
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+
+    @abstractmethod
+    def purge(self, max_age: float) -> int:
+        """Delete results older than ``max_age`` seconds and return how many were removed."""
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        if self.ttl <= 0 or now < self._next_purge:
+            return 0
+        self._next_purge = now + self.purge_interval
+        try:
+            return self.purge(self.ttl)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Result store purge failed: %s", exc)
+            return 0
+
+
+class FileResultStore(_ExpiringResultStore):
+    """Gzip-compressed JSON results under ``directory``, one file per task."""
+
+    kind = "file"
+
+    def __init__(
+        self, directory: str, compresslevel: int = 6, ttl: float = 0.0, purge_interval: float = 3600.0
+    ) -> None:
+        super().__init__(ttl, purge_interval)
+        self.directory = directory
+        self.compresslevel = compresslevel
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{_validated_key(key)}.json.gz")
+
+    def save(self, key: str, result: Any) -> Dict[str, Any]:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        descriptor, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".part")
+        try:
+            with os.fdopen(descriptor, "wb") as raw, gzip.GzipFile(
+                fileobj=raw, mode="wb", compresslevel=self.compresslevel
+            ) as compressed, io.TextIOWrapper(compressed, encoding="utf-8") as text:
+                json.dump(result, text, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        size = os.path.getsize(path)
+        self.purge_expired()
+        return {"store": self.kind, "key": key, "size": size}
+
+    def open(self, key: str) -> IO[bytes]:
+        return gzip.open(self._path(key), "rb")
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def purge(self, max_age: float) -> int:
+        cutoff = time.time() - max_age
+        removed = 0
+        try:
+            entries = os.scandir(self.directory)
+        except FileNotFoundError:
+            return 0
+        with entries:
+            for entry in entries:
+                # .*.part are temporary files of save() calls that crashed before os.replace
+                is_partial = entry.name.startswith(".") and entry.name.endswith(".part")
+                if not (entry.name.endswith(".json.gz") or is_partial):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    # removed concurrently by another process
+                    continue
+        return removed
+
+
+class PostgresResultStore(_ExpiringResultStore):
+    """Gzip-compressed JSON results in a ``bytea`` column of ``table``."""
+
+    kind = "postgres"
+
+    def __init__(
+        self,
+        db_factory: Any,
+        table: str = "task_results",
+        compresslevel: int = 6,
+        ttl: float = 0.0,
+        purge_interval: float = 3600.0,
+    ) -> None:
+        super().__init__(ttl, purge_interval)
+        self.db_factory = db_factory
+        self.table = _validated_key(table)
+        self.compresslevel = compresslevel
+        self._table_ready = False
+
+    def ensure_table(self, db: Any) -> None:
+        if self._table_ready:
+            return
+        db.execute(
+            f"create table if not exists {self.table} ("
+            "task_id text primary key, payload bytea not null, created timestamptz not null default now())"
+        )
+        db.commit()
+        self._table_ready = True
+
+    def save(self, key: str, result: Any) -> Dict[str, Any]:
+        buffer = io.BytesIO()
+        with gzip.GzipFile(
+            fileobj=buffer, mode="wb", compresslevel=self.compresslevel
+        ) as compressed, io.TextIOWrapper(compressed, encoding="utf-8") as text:
+            json.dump(result, text, separators=(",", ":"))
+        payload = buffer.getvalue()
+        with self.db_factory() as db:
+            self.ensure_table(db)
+            db.execute(
+                f"insert into {self.table} (task_id, payload) values (%s, %s) "
+                "on conflict (task_id) do update set payload = excluded.payload, created = now()",
+                [key, psycopg2.Binary(payload)],
+            )
+            db.commit()
+        self.purge_expired()
+        return {"store": self.kind, "key": key, "size": len(payload)}
+
+    def open(self, key: str) -> IO[bytes]:
+        with self.db_factory() as db:
+            row = db.fetchone(f"select payload from {self.table} where task_id=%s", [key])
+        if row is None:
+            raise FileNotFoundError(f"No stored result for {key}")
+        return gzip.GzipFile(fileobj=io.BytesIO(bytes(row[0])), mode="rb")
+
+    def delete(self, key: str) -> None:
+        with self.db_factory() as db:
+            db.execute(f"delete from {self.table} where task_id=%s", [key])
+            db.commit()
+
+    def purge(self, max_age: float) -> int:
+        with self.db_factory() as db:
+            removed = db.execute_and_return(
+                f"with deleted as (delete from {self.table} where created < now() - %s * interval '1 second' "
+                "returning 1) select count(*) from deleted",
+                [max_age],
+            )
+            db.commit()
+        return int(removed)
+
+
+def iter_stored_result(stream: IO[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the decompressed JSON bytes of an opened stored result, closing it at the end."""
+
+    with stream:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
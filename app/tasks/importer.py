@@ -1,10 +1,37 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+import time
+from typing import Any, Callable, Dict, List
 
 from celery import Celery
+from flask import current_app
 
-from app.blueprints.importer import _process_record
+from app.blueprints.importer import _iter_processed_shards, _merge_cached, _process_record, _process_records
+from app.dedup import dedup_key, split_cached
+from app.extensions import get_dedup_cache, get_result_store
+
+
+class ProgressThrottle:
+    """Decide when a progress update is worth a result-backend write.
+
+    An update is due once ``every_records`` more records are done or ``interval`` seconds
+    have passed since the last write, whichever comes first.
+    """
+
+    def __init__(self, every_records: int, interval: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.every_records = max(1, every_records)
+        self.interval = interval
+        self.clock = clock
+        self.last_current = 0
+        self.last_time = clock()
+
+    def due(self, current: int) -> bool:
+        now = self.clock()
+        if current - self.last_current < self.every_records and now - self.last_time < self.interval:
+            return False
+        self.last_current = current
+        self.last_time = now
+        return True
 
 
 def register_importer_tasks(celery_app: Celery) -> None:
@@ -15,10 +42,39 @@ def register_importer_tasks(celery_app: Celery) -> None:
         if not isinstance(record, dict):
             raise TypeError("Record payload must be a dictionary")
 
-        return _process_record(record)
+        cache = get_dedup_cache(current_app)
+        if cache is None:
+            return _process_record(record)
+
+        key = dedup_key(record)
+        hit = cache.get_many([key]).get(key)
+        if hit is not None:
+            return dict(hit, cached=True)
+        result = _process_record(record)
+        cache.set_many([(key, result)])
+        return result
 
     celery_app.tasks.register(process_record_task)
 
+    @celery_app.task(name="app.tasks.importer.process_records_task")
+    def process_records_task(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Normalize a chunk of importer records in one task."""
+
+        if not isinstance(records, list):
+            raise TypeError("Records payload must be a list")
+
+        parallel_threshold = current_app.config["IMPORTER_PARALLEL_THRESHOLD"]
+        processes = current_app.config["IMPORTER_PROCESSES"]
+        cache = get_dedup_cache(current_app)
+        if cache is None:
+            return _process_records(records, parallel_threshold, processes)
+
+        keys, hits, pending_records = split_cached(records, cache)
+        processed = _process_records(pending_records, parallel_threshold, processes)
+        return _merge_cached(keys, hits, processed, cache)
+
+    celery_app.tasks.register(process_records_task)
+
     @celery_app.task(bind=True, name="app.tasks.importer.process_batch_with_progress")
     def process_batch_with_progress(
         self, records: List[Dict[str, Any]]
@@ -30,19 +86,35 @@ def register_importer_tasks(celery_app: Celery) -> None:
 
         processed_records: List[Dict[str, Any]] = []
         total = len(records)
+        shards = _iter_processed_shards(
+            records,
+            current_app.config["IMPORTER_PARALLEL_THRESHOLD"],
+            current_app.config["IMPORTER_PROCESSES"],
+            shard_size=max(1, total // 100),
+        )
+
+        celery_config = current_app.config["CELERY_CONFIG"]
+        throttle = ProgressThrottle(celery_config.progress_every_records, celery_config.progress_interval)
 
-        for index, record in enumerate(records):
-            processed_records.append(_process_record(record))
-            progress_percentage = int(((index + 1) / max(total, 1)) * 100)
+        for shard in shards:
+            processed_records.extend(shard)
+            current = len(processed_records)
+            if current < total and not throttle.due(current):
+                continue
+            progress_percentage = int((current / max(total, 1)) * 100)
             self.update_state(
                 state="PROGRESS",
                 meta={
-                    "current": index + 1,
+                    "current": current,
                     "total": total,
                     "progress": progress_percentage,
                 },
             )
 
-        return {"processed": processed_records, "total": total}
+        result = {"processed": processed_records, "total": total}
+        store = get_result_store(current_app)
+        if store is not None and total >= celery_config.result_store_threshold:
+            return {"total": total, "result_ref": store.save(self.request.id, result)}
+        return result
 
     celery_app.tasks.register(process_batch_with_progress)
@@ -0,0 +1,62 @@
+import hashlib
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+BUFFER_SIZE = 8 * 1024 * 1024
+QUICK_BLOCK_SIZE = 64 * 1024
+
+
+# md5 файла потоково: большим буфером (readinto без лишних копий) или через mmap,
+# файл целиком в память не читается. hashlib отпускает GIL на больших блоках.
+def md5_file(path, buffer_size=BUFFER_SIZE, use_mmap=False):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        if use_mmap:
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    digest.update(mm)
+            return digest.hexdigest()
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+# Быстрый предварительный хеш: размер + первый и последний блоки.
+# Разные quick_hash -> точно разные файлы; одинаковые нужно досчитать через md5_file.
+def quick_hash(path, block_size=QUICK_BLOCK_SIZE):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        digest.update(str(size).encode())
+        digest.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(size - block_size, block_size))
+            digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def _hash_job(job):
+    path, quick = job
+    try:
+        return quick_hash(path) if quick else md5_file(path)
+    except OSError as e:
+        return e
+
+
+# Хеширует много файлов в пуле процессов. Отдаёт (path, md5 или OSError) в порядке paths,
+# по мере готовности, поэтому результат можно сразу передавать в импорт.
+def hash_files(paths, processes=None, quick=False):
+    paths = list(paths)
+    jobs = [(path, quick) for path in paths]
+    if processes == 1 or len(paths) <= 1:
+        results = map(_hash_job, jobs)
+        yield from zip(paths, results)
+        return
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        yield from zip(paths, executor.map(_hash_job, jobs))
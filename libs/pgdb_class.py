@@ -1,5 +1,343 @@
+import collections
+import functools
+import json
+import keyword
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+import psycopg2.sql
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Потокобезопасный пул соединений, общий для процесса.
+# pool = pgdb_pool(minconn=1, maxconn=10, timeout=30, user=..., database=...)
+# con = pool.getconn(); ...; pool.putconn(con)
+class pgdb_pool:
+    def __init__(self, minconn=1, maxconn=10, timeout=30, check_interval=10, **connect_kwargs):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError(f"invalid pool size: min={minconn} max={maxconn}")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.connect_kwargs = connect_kwargs
+        self._cond = threading.Condition()
+        self._idle = []  # [(con, время возврата в пул)]
+        self._size = 0
+        self._closed = False
+        self._pid = os.getpid()
+        for _ in range(minconn):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(**self.connect_kwargs)
+
+    def _check_fork(self):
+        # После fork (celery prefork) сокеты родителя нельзя ни использовать, ни закрывать.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._size = 0
+
+    def _is_alive(self, con, idle_since):
+        if con.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+        try:
+            cur = con.cursor()
+            cur.execute("select 1")
+            cur.close()
+            con.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, con):
+        try:
+            con.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                self._check_fork()
+                while True:
+                    if self._closed:
+                        raise psycopg2.pool.PoolError("connection pool is closed")
+                    if self._idle:
+                        con, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        con, idle_since = None, None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"no free connection in pool after {self.timeout}s")
+                    self._cond.wait(remaining)
+
+            if con is not None:
+                if self._is_alive(con, idle_since):
+                    return con
+                self._discard(con)
+            try:
+                return self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+    def putconn(self, con, close=False):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            if not close and not con.closed:
+                try:
+                    if con.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        con.rollback()
+                except psycopg2.Error:
+                    close = True
+            if close or con.closed or self._closed:
+                self._discard(con)
+                self._size -= 1
+            else:
+                self._idle.append((con, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            if self._pid == os.getpid():
+                for con, _ in self._idle:
+                    self._discard(con)
+            self._idle = []
+            self._cond.notify_all()
+
+
+# Фабрики строк: factory(cursor.description) -> функция row -> объект (None = как есть, tuple).
+# Имена колонок разбираются один раз на результат, а не на каждую строку.
+# db = pgdb(row_factory=dict_rows); db.fetchall(sql, row_factory=record_rows)
+def _column_names(description):
+    return tuple(col[0] for col in description)
+
+
+def _field_names(columns):
+    names = []
+    for index, name in enumerate(columns):
+        if not name.isidentifier() or keyword.iskeyword(name) or name.startswith('_') or name in names:
+            name = f"_{index}"
+        names.append(name)
+    return tuple(names)
+
+
+@functools.lru_cache(maxsize=256)
+def _namedtuple_class(columns):
+    return collections.namedtuple('Row', columns, rename=True)
+
+
+@functools.lru_cache(maxsize=256)
+def _record_class(columns):
+    fields = _field_names(columns)
+    args = ", ".join(fields)
+    body = "".join(f"\n    self.{name} = {name}" for name in fields) or "\n    pass"
+    namespace = {}
+    exec(f"def __init__(self, {args}):{body}", namespace)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return "Record(" + ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__) + ")"
+
+    def __eq__(self, other):
+        return type(other) is type(self) and tuple(self) == tuple(other)
+
+    def _asdict(self):
+        return dict(zip(self.__slots__, self))
+
+    return type('Record', (), {
+        '__slots__': fields, '__init__': namespace['__init__'], '__iter__': __iter__,
+        '__repr__': __repr__, '__eq__': __eq__, '__hash__': None, '_asdict': _asdict,
+    })
+
+
+def tuple_rows(description):
+    return None
+
+
+def dict_rows(description):
+    columns = _column_names(description)
+    return lambda row: dict(zip(columns, row))
+
+
+def namedtuple_rows(description):
+    return _namedtuple_class(_column_names(description))._make
+
+
+def record_rows(description):
+    record_class = _record_class(_column_names(description))
+    return lambda row: record_class(*row)
+
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        value = '\\x' + bytes(value).hex()
+    else:
+        value = str(value)
+    return value.translate(_COPY_ESCAPES)
+
+
+# Файлоподобный объект для COPY ... FROM STDIN: строки текстового формата
+# генерируются по мере чтения, весь поток в памяти не собирается.
+class copy_stream:
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.buffer += '\t'.join(map(_copy_value, row)) + '\n'
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def _table_identifier(table):
+    return psycopg2.sql.Identifier(*table.split('.'))
+
+
+def _columns_sql(columns):
+    return psycopg2.sql.SQL(',').join(map(psycopg2.sql.Identifier, columns))
+
+
+# Соединение с кешем подготовленных запросов: sql -> [число вызовов, имя prepared или None].
+# PREPARE живёт в сессии и транзакциями не откатывается, поэтому кеш привязан к соединению
+# и переживает возврат соединения в пул.
+class pgdb_connection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = collections.OrderedDict()
+        self.statement_seq = 0
+        self.stale_statements = []
+
+
+_PREPARABLE = re.compile(r'\s*(select|insert|update|delete|with|values)\b', re.IGNORECASE)
+_PLACEHOLDER = re.compile(r'%%|%s')
+
+
+def _server_placeholders(sql, pars):
+    # "... md5=%s" -> "... md5=$1"; None, если запрос нельзя подготовить.
+    if not isinstance(pars, (list, tuple)) or not _PREPARABLE.match(sql) or '%(' in sql:
+        return None
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group(0) == '%%':
+            return '%'
+        count += 1
+        return f"${count}"
+
+    server_sql = _PLACEHOLDER.sub(replace, sql)
+    if count != len(pars):
+        return None
+    return server_sql
+
+
+_FINGERPRINT_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s|\$\d+")
+_FINGERPRINT_SPACES = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=1024)
+def sql_fingerprint(sql):
+    # "select * from books where id=5" и "... id=%s" -> "select * from books where id=?"
+    sql = _FINGERPRINT_LITERALS.sub('?', sql)
+    return _FINGERPRINT_SPACES.sub(' ', sql).strip().lower()
+
+
+def _pars_shape(pars):
+    # В лог медленных запросов пишем только типы и размеры параметров, не значения.
+    if isinstance(pars, dict):
+        return {key: _pars_shape(value) for key, value in pars.items()}
+    if isinstance(pars, (list, tuple)):
+        return [_value_shape(value) for value in pars]
+    return _value_shape(pars)
+
+
+def _value_shape(value):
+    name = type(value).__name__
+    if isinstance(value, (str, bytes, list, tuple, dict)):
+        return f"{name}[{len(value)}]"
+    return name
+
+
+# Агрегированная статистика запросов процесса по нормализованному sql.
+class query_stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, sql, seconds, rows):
+        fingerprint = sql_fingerprint(sql)
+        ms = seconds * 1000
+        with self._lock:
+            entry = self._stats.get(fingerprint)
+            if entry is None:
+                entry = self._stats[fingerprint] = {"calls": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0}
+            entry["calls"] += 1
+            entry["total_ms"] += ms
+            if ms > entry["max_ms"]:
+                entry["max_ms"] = ms
+            if rows > 0:
+                entry["rows"] += rows
+
+    def snapshot(self, limit=None):
+        with self._lock:
+            items = [dict(entry, sql=sql) for sql, entry in self._stats.items()]
+        for item in items:
+            item["avg_ms"] = item["total_ms"] / item["calls"]
+        items.sort(key=lambda item: item["total_ms"], reverse=True)
+        return items[:limit] if limit else items
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
 
 # with pgdb(user, database, password, host, port) as db:
 class pgdb:
@@ -8,73 +346,257 @@ class pgdb:
     PG_USER = 'tbc'
     PG_PASSWORD = 'tbcpass'
     PG_DB = 'books'    
+    POOL = None
+    PREPARE_STATEMENTS = False
+    PREPARE_THRESHOLD = 2
+    PREPARE_CACHE_SIZE = 128
+    STATS = query_stats()
+    SLOW_QUERY_MS = None
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.con.close()
+        self.close()
 
-    def __init__(self):
-        self.con = psycopg2.connect(user=self.PG_USER, database=self.PG_DB,
-                password=self.PG_PASSWORD, host=self.PG_HOST,  port=self.PG_PORT, application_name="")
+    def __init__(self, row_factory=None):
+        self.row_factory = row_factory or tuple_rows
+        self.pool = self.POOL
+        if self.pool is not None:
+            self.con = self.pool.getconn()
+        else:
+            self.con = psycopg2.connect(**self.connect_kwargs())
         self.cur = self.con.cursor()
 
+    @classmethod
+    def connect_kwargs(cls):
+        return dict(user=cls.PG_USER, database=cls.PG_DB,
+                password=cls.PG_PASSWORD, host=cls.PG_HOST,  port=cls.PG_PORT, application_name="",
+                connection_factory=pgdb_connection)
+
+    @classmethod
+    def configure_pool(cls, minconn=1, maxconn=10, timeout=30, check_interval=10):
+        old_pool = cls.POOL
+        cls.POOL = pgdb_pool(minconn=minconn, maxconn=maxconn, timeout=timeout,
+                check_interval=check_interval, **cls.connect_kwargs())
+        if old_pool is not None:
+            old_pool.closeall()
+        return cls.POOL
+
+    @classmethod
+    def close_pool(cls):
+        if cls.POOL is not None:
+            cls.POOL.closeall()
+            cls.POOL = None
+
     def convert_to_dict(self, columns, results):
-        allResults = []
-        columns = [col.name for col in columns]
+        make = dict_rows(columns)
         if type(results) is list:
-            for value in results:
-                allResults.append(dict(zip(columns, value)))
-            return allResults
+            return list(map(make, results))
         elif type(results) is tuple:
-            allResults.append(dict(zip(columns, results)))
-            return allResults
+            return [make(results)]
 
     def build_dict(self, cursor, row):
-        x = {}
-        for key, col in enumerate(cursor.description):
-            x[col[0]] = row[key]
-        return x 
+        return dict(zip(_column_names(cursor.description), row))
+
+    def _row_maker(self, row_factory, description):
+        return (row_factory or self.row_factory)(description)
 
     def cursor(self):
         self.cur = self.con.cursor() 
         return self.cur
 
-    def fetchone(self, sql, pars=[]):
-        self.cur.execute(sql, pars)
-        return self.cur.fetchone()
+    def _prepared_name(self, sql, pars):
+        statements = getattr(self.con, 'statements', None)
+        if not self.PREPARE_STATEMENTS or statements is None or not isinstance(sql, str):
+            return None
+        self._deallocate_stale()
+        entry = statements.get(sql)
+        if entry is None:
+            entry = statements[sql] = [0, None]
+            while len(statements) > self.PREPARE_CACHE_SIZE:
+                _, (_, old_name) = statements.popitem(last=False)
+                if old_name:
+                    self.cur.execute(f"deallocate {old_name}")
+        else:
+            statements.move_to_end(sql)
+        entry[0] += 1
+        if entry[1] is None and entry[0] >= self.PREPARE_THRESHOLD:
+            server_sql = _server_placeholders(sql, pars)
+            if server_sql is None:
+                # больше не пытаемся, но счётчик держим, чтобы не разбирать sql повторно
+                entry[1] = False
+                return None
+            self.con.statement_seq += 1
+            name = f"pgdb_ps_{self.con.statement_seq}"
+            # savepoint: если сервер не сможет вывести типы параметров, транзакция не ломается
+            try:
+                self.cur.execute(f"savepoint pgdb_prepare; prepare {name} as {server_sql}; "
+                                 f"release savepoint pgdb_prepare")
+            except psycopg2.Error:
+                self.cur.execute("rollback to savepoint pgdb_prepare")
+                entry[1] = False
+                return None
+            entry[1] = name
+        return entry[1] or None
+
+    def _record(self, sql, pars, started, rows):
+        if self.STATS is None and self.SLOW_QUERY_MS is None:
+            return
+        seconds = time.perf_counter() - started
+        if not isinstance(sql, str):
+            sql = sql.as_string(self.con)
+        if self.STATS is not None:
+            self.STATS.record(sql, seconds, rows)
+        if self.SLOW_QUERY_MS is not None and seconds * 1000 >= self.SLOW_QUERY_MS:
+            logger.warning("slow query %.1f ms, rows=%s: %s pars=%s",
+                           seconds * 1000, rows, _FINGERPRINT_SPACES.sub(' ', sql).strip(), _pars_shape(pars))
+
+    def _execute(self, sql, pars=[]):
+        started = time.perf_counter()
+        idle = self.con.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        name = self._prepared_name(sql, pars)
+        if name is None:
+            self.cur.execute(sql, pars)
+        else:
+            try:
+                if pars:
+                    self.cur.execute(f"execute {name} ({','.join(['%s'] * len(pars))})", pars)
+                else:
+                    self.cur.execute(f"execute {name}")
+            except psycopg2.errors.FeatureNotSupported:
+                # "cached plan must not change result type": таблицу изменили (alter table) после PREPARE.
+                # Забываем запрос; если транзакцию открыл этот же вызов, откатываем её и повторяем без
+                # prepare, иначе транзакция вызывающего уже прервана и ошибку нужно отдать ему.
+                self._forget_prepared(sql, name)
+                if not idle:
+                    raise
+                self.con.rollback()
+                self._deallocate_stale()
+                self.cur.execute(sql, pars)
+        self._record(sql, pars, started, self.cur.rowcount)
+
+    def _forget_prepared(self, sql, name):
+        self.con.statements.pop(sql, None)
+        self.con.stale_statements.append(name)
+
+    def _deallocate_stale(self):
+        # DEALLOCATE нельзя выполнить в прерванной транзакции, поэтому откладываем до первой возможности
+        stale = getattr(self.con, 'stale_statements', None)
+        if not stale or self.con.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            return
+        while stale:
+            self.cur.execute(f"deallocate {stale.pop()}")
+
+    def fetchone(self, sql, pars=[], row_factory=None):
+        self._execute(sql, pars)
+        row = self.cur.fetchone()
+        make = self._row_maker(row_factory, self.cur.description)
+        if row is None or make is None:
+            return row
+        return make(row)
 
-    def fetchall(self, sql, pars=[]):
-        self.cur.execute(sql, pars)
-        return self.cur.fetchall()
+    def fetchall(self, sql, pars=[], row_factory=None):
+        self._execute(sql, pars)
+        rows = self.cur.fetchall()
+        make = self._row_maker(row_factory, self.cur.description)
+        if make is None:
+            return rows
+        return list(map(make, rows))
     
     def fetchone_dict(self, sql, pars=[]):
-        self.cur.execute(sql, pars)
-        row = self.cur.fetchone()
+        row = self.fetchone(sql, pars, row_factory=dict_rows)
         if row:
-            row = self.build_dict(self.cur, row)
             return row
         else:
             return False
 
-    def fetchall_dict(self, sql, pars=[]):                                                                                                              
-        self.cur.execute(sql, pars)
-        allrows = []
-        for row in  self.cur.fetchall():
-            row = self.build_dict(self.cur, row)
-            allrows.append(row)
-        return allrows
+    def fetchall_dict(self, sql, pars=[]):
+        return self.fetchall(sql, pars, row_factory=dict_rows)
+
+    def iter_batches(self, sql, pars=[], itersize=2000, withhold=False):
+        # Серверный (именованный) курсор: строки приходят пачками по itersize,
+        # весь результат в память клиента не загружается.
+        # withhold=True позволяет делать commit() внутри цикла.
+        cur = self.con.cursor(name=f"pgdb_iter_{uuid.uuid4().hex}", withhold=withhold)
+        cur.itersize = itersize
+        started = time.perf_counter()
+        total = 0
+        try:
+            cur.execute(sql, pars)
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                total += len(rows)
+                yield cur.description, rows
+        finally:
+            if not self.con.closed:
+                cur.close()
+            # время включает обработку строк вызывающим кодом между пачками
+            self._record(sql, pars, started, total)
+
+    def iterall(self, sql, pars=[], itersize=2000, withhold=False, row_factory=None):
+        make = False
+        for description, rows in self.iter_batches(sql, pars, itersize, withhold):
+            if make is False:
+                make = self._row_maker(row_factory, description)
+            if make is None:
+                yield from rows
+            else:
+                yield from map(make, rows)
+
+    def iter_dict(self, sql, pars=[], itersize=2000, withhold=False):
+        return self.iterall(sql, pars, itersize, withhold, row_factory=dict_rows)
+
+    def insert_many(self, table, columns, rows, page_size=1000, returning=None):
+        # Многострочный insert: одна команда на page_size строк вместо одной на строку.
+        sql = psycopg2.sql.SQL("insert into {} ({}) values %s").format(
+            _table_identifier(table), _columns_sql(columns))
+        if returning:
+            sql += psycopg2.sql.SQL(" returning ") + _columns_sql([returning] if isinstance(returning, str) else returning)
+        started = time.perf_counter()
+        total = 0
+
+        def counted(rows):
+            nonlocal total
+            for row in rows:
+                total += 1
+                yield row
+
+        result = psycopg2.extras.execute_values(self.cur, sql, counted(rows), page_size=page_size, fetch=bool(returning))
+        self._record(sql, [], started, total)
+        return result
+
+    def copy_rows(self, table, columns, rows, size=65536):
+        # COPY ... FROM STDIN; rows может быть генератором любой длины.
+        sql = psycopg2.sql.SQL("copy {} ({}) from stdin").format(
+            _table_identifier(table), _columns_sql(columns))
+        started = time.perf_counter()
+        self.cur.copy_expert(sql, copy_stream(rows), size=size)
+        self._record(sql, [], started, self.cur.rowcount)
+        return self.cur.rowcount
 
     def commit(self):
         self.con.commit()
 
+    def rollback(self):
+        self.con.rollback()
+
     def execute(self, sql, pars=[]):
-        self.cur.execute(sql, pars)
+        self._execute(sql, pars)
 
     def execute_and_return(self, sql, pars=[]):
-        self.cur.execute(sql, pars)
+        self._execute(sql, pars)
         return self.cur.fetchone()[0]
 
     def close(self):
-        self.con.close()
+        if self.con is None:
+            return
+        if self.pool is not None:
+            if not self.cur.closed:
+                self.cur.close()
+            self.pool.putconn(self.con)
+        else:
+            self.con.close()
+        self.con = None
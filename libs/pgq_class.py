@@ -1,11 +1,66 @@
+import logging
+import multiprocessing
+import re
+import select
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
 class pgq_class:
-    def __init__(self, db, table_name, id_column_name='id', status_column_name='pgq_status', filter=" 1=1 "):
+    def __init__(self, db, table_name, id_column_name='id', status_column_name='pgq_status', filter=" 1=1 ",
+                 batch_size=100, min_batch_size=1, max_batch_size=1000, target_batch_seconds=None, channel=None,
+                 lease_column_name=None, lease_seconds=300, created_column_name=None, attempts_column_name=None,
+                 max_attempts=5, claimed_column_name=None):
         self.db = db
         self.table_name = table_name
         self.id_column_name = id_column_name
         self.status_column_name = status_column_name
-        self.statuses = {"inqueue": 0, "processing": 1, 'completed': 2}
+        self.statuses = {"inqueue": 0, "processing": 1, 'completed': 2, 'failed': 3}
         self.filter = filter
+        # target_batch_seconds: если задано, batch_size подстраивается так,
+        # чтобы обработка одной пачки занимала примерно это время
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_batch_seconds = target_batch_seconds
+        self._claimed_at = None
+        # канал LISTEN/NOTIFY очереди, см. install_notify_trigger() и wait_for_task()
+        self.channel = channel or ("pgq_" + re.sub(r'\W', '_', table_name))[:63]
+        self._listening = False
+        # lease_column_name: timestamptz-колонка, до которого момента задача закреплена за воркером;
+        # просроченные задачи возвращает в очередь reclaim_expired()
+        self.lease_column_name = lease_column_name
+        self.lease_seconds = lease_seconds
+        # created_column_name: timestamp постановки в очередь, нужен stats() для возраста старейшей задачи
+        self.created_column_name = created_column_name
+        # attempts_column_name: integer-счётчик захватов задачи; после max_attempts неудачных попыток
+        # задача уходит в failed вместо очередного возврата в очередь
+        self.attempts_column_name = attempts_column_name
+        self.max_attempts = max_attempts
+        # claimed_column_name: timestamptz момента захвата, по нему stats() считает claim_rate всех воркеров
+        self.claimed_column_name = claimed_column_name
+        self.claimed_total = 0
+
+    def _claim_set(self):
+        sql = f"{self.status_column_name} = {self.statuses['processing']}"
+        if self.lease_column_name:
+            sql += f", {self.lease_column_name} = now() + {float(self.lease_seconds)} * interval '1 second'"
+        if self.attempts_column_name:
+            sql += f", {self.attempts_column_name} = coalesce({self.attempts_column_name}, 0) + 1"
+        if self.claimed_column_name:
+            sql += f", {self.claimed_column_name} = now()"
+        return sql
+
+    def _retry_status(self):
+        # Статус для упавшей задачи: без счётчика попыток сразу failed, со счётчиком - обратно в очередь,
+        # пока не исчерпан max_attempts
+        if not self.attempts_column_name:
+            return str(self.statuses['failed'])
+        return f"case when coalesce({self.attempts_column_name}, 0) >= {int(self.max_attempts)} " \
+               f"then {self.statuses['failed']} else {self.statuses['inqueue']} end"
 
     def get_task(self):
         sql = f"""with next_task as (                                                                                                                                                                                                                                                   
@@ -13,13 +68,14 @@ class pgq_class:
         and {self.filter}
         order by {self.id_column_name} limit 1 
         for update skip locked )                                                                                                                                            
-        update {self.table_name} set {self.status_column_name} = {self.statuses['processing']} from next_task  
+        update {self.table_name} set {self._claim_set()} from next_task  
         where {self.table_name}.{self.id_column_name} = next_task.{self.id_column_name}                                                                                                                      
         returning {self.table_name}.{self.id_column_name}"""
 
         row = self.db.fetchone(sql)
         self.db.commit()
         if row:
+            self.claimed_total += 1
             return row[0]
         return False
 
@@ -28,3 +84,374 @@ class pgq_class:
               f"where {self.id_column_name}=%s"
         self.db.execute(sql, [id])
         self.db.commit()
+
+    def get_tasks(self, n=None):
+        if n is None:
+            n = self.batch_size
+        sql = f"""with next_tasks as (
+        select {self.id_column_name} from {self.table_name} where {self.status_column_name} = {self.statuses['inqueue']}
+        and {self.filter}
+        order by {self.id_column_name} limit %s
+        for update skip locked )
+        update {self.table_name} set {self._claim_set()} from next_tasks
+        where {self.table_name}.{self.id_column_name} = next_tasks.{self.id_column_name}
+        returning {self.table_name}.{self.id_column_name}"""
+
+        rows = self.db.fetchall(sql, [n])
+        self.db.commit()
+        self.claimed_total += len(rows)
+        self._claimed_at = time.monotonic()
+        return sorted(row[0] for row in rows)
+
+    def complete_tasks(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        sql = f"update {self.table_name} set {self.status_column_name}={self.statuses['completed']} " \
+              f"where {self.id_column_name} = any(%s)"
+        self.db.execute(sql, [ids])
+        self.db.commit()
+        if self._claimed_at is not None:
+            self.adapt_batch_size(len(ids), time.monotonic() - self._claimed_at)
+            self._claimed_at = None
+
+    def adapt_batch_size(self, processed, seconds):
+        if self.target_batch_seconds is None or processed <= 0:
+            return self.batch_size
+        per_task = max(seconds, 1e-6) / processed
+        wanted = self.target_batch_seconds / per_task
+        # не больше чем вдвое за шаг, чтобы один выброс не раскачивал размер пачки
+        wanted = min(max(wanted, self.batch_size / 2), self.batch_size * 2)
+        self.batch_size = int(min(max(wanted, self.min_batch_size), self.max_batch_size))
+        return self.batch_size
+
+    def install_notify_trigger(self):
+        # Триггер шлёт NOTIFY при появлении строки в статусе inqueue.
+        # Пустой payload: одинаковые уведомления внутри транзакции postgres схлопывает в одно.
+        schema, _, table = self.table_name.rpartition('.')
+        function_name = f"{schema + '.' if schema else ''}{table}_pgq_notify"
+        trigger_name = f"{table}_pgq_notify"
+        self.db.execute(f"""create or replace function {function_name}() returns trigger language plpgsql as $$
+        begin
+            perform pg_notify('{self.channel}', '');
+            return null;
+        end $$""")
+        self.db.execute(f"drop trigger if exists {trigger_name} on {self.table_name}")
+        self.db.execute(f"""create trigger {trigger_name}
+        after insert or update of {self.status_column_name} on {self.table_name}
+        for each row when (NEW.{self.status_column_name} = {self.statuses['inqueue']})
+        execute function {function_name}()""")
+        self.db.commit()
+
+    def listen(self):
+        if not self._listening:
+            self.db.execute(f'listen "{self.channel}"')
+            self.db.commit()
+            self._listening = True
+
+    def unlisten(self):
+        if self._listening:
+            self.db.execute(f'unlisten "{self.channel}"')
+            self.db.commit()
+            self._listening = False
+
+    def wait_for_task(self, timeout=30):
+        # Ждёт задачу не дольше timeout секунд: между попытками get_task спит в select()
+        # на сокете соединения до прихода NOTIFY. Без триггера работает как опрос раз в timeout.
+        deadline = time.monotonic() + timeout
+        self.listen()
+        con = self.db.con
+        while True:
+            del con.notifies[:]
+            task = self.get_task()
+            if task:
+                return task
+            if con.notifies:
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if select.select([con], [], [], remaining) != ([], [], []):
+                con.poll()
+
+    def ensure_lease_column(self):
+        self.db.execute(f"alter table {self.table_name} add column if not exists {self.lease_column_name} timestamptz")
+        self.db.commit()
+
+    def ensure_claimed_column(self):
+        self.db.execute(f"alter table {self.table_name} add column if not exists {self.claimed_column_name} timestamptz")
+        self.db.commit()
+
+    def ensure_attempts_column(self):
+        self.db.execute(f"alter table {self.table_name} add column if not exists {self.attempts_column_name} "
+                        f"integer not null default 0")
+        self.db.commit()
+
+    def extend_lease(self, ids):
+        ids = list(ids)
+        if not self.lease_column_name or not ids:
+            return
+        sql = f"update {self.table_name} set {self.lease_column_name} = now() + %s * interval '1 second' " \
+              f"where {self.id_column_name} = any(%s) and {self.status_column_name} = {self.statuses['processing']}"
+        self.db.execute(sql, [float(self.lease_seconds), ids])
+        self.db.commit()
+
+    def release_tasks(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        lease_set = f", {self.lease_column_name} = null" if self.lease_column_name else ""
+        if self.attempts_column_name:
+            # задача не обрабатывалась, захват не считается попыткой
+            lease_set += f", {self.attempts_column_name} = greatest(coalesce({self.attempts_column_name}, 0) - 1, 0)"
+        sql = f"update {self.table_name} set {self.status_column_name} = {self.statuses['inqueue']}{lease_set} " \
+              f"where {self.id_column_name} = any(%s)"
+        self.db.execute(sql, [ids])
+        self.db.commit()
+
+    def fail_tasks(self, ids):
+        # Упавшие задачи: снова в очередь, пока есть попытки, иначе в failed. Возвращает id ушедших в failed.
+        ids = list(ids)
+        if not ids:
+            return []
+        lease_set = f", {self.lease_column_name} = null" if self.lease_column_name else ""
+        sql = f"update {self.table_name} set {self.status_column_name} = {self._retry_status()}{lease_set} " \
+              f"where {self.id_column_name} = any(%s) and {self.status_column_name} = {self.statuses['processing']} " \
+              f"returning {self.id_column_name}, {self.status_column_name}"
+        rows = self.db.fetchall(sql, [ids])
+        self.db.commit()
+        failed = [row[0] for row in rows if row[1] == self.statuses['failed']]
+        if failed:
+            logger.error("%s: tasks %s failed permanently", self.table_name, failed)
+        return failed
+
+    def reclaim_expired(self):
+        # Задачи умерших воркеров: processing с истёкшей арендой снова становятся inqueue
+        # (или failed, если при счётчике попыток они уже исчерпаны - задача, роняющая воркер, не крутится вечно).
+        if not self.lease_column_name:
+            return []
+        status = self._retry_status() if self.attempts_column_name else self.statuses['inqueue']
+        sql = f"update {self.table_name} set {self.status_column_name} = {status}, " \
+              f"{self.lease_column_name} = null " \
+              f"where {self.status_column_name} = {self.statuses['processing']} " \
+              f"and {self.lease_column_name} < now() returning {self.id_column_name}"
+        rows = self.db.fetchall(sql)
+        self.db.commit()
+        ids = [row[0] for row in rows]
+        if ids:
+            logger.warning("%s: reclaimed %s tasks with expired lease", self.table_name, len(ids))
+        return ids
+
+    def _index_name(self, suffix):
+        return f"{self.table_name.rpartition('.')[2]}_{self.status_column_name}_{suffix}"[:63]
+
+    def _partial_predicates(self):
+        # Условия частичных индексов ensure_indexes() по статусам; processing индексируется только при аренде.
+        # stats() считает строки ровно по этим условиям, иначе планировщик не возьмёт индекс.
+        inqueue = f"{self.status_column_name} = {self.statuses['inqueue']}"
+        if self.filter.strip() != "1=1":
+            inqueue += f" and ({self.filter})"
+        predicates = {'inqueue': inqueue}
+        if self.lease_column_name:
+            predicates['processing'] = f"{self.status_column_name} = {self.statuses['processing']}"
+        predicates['failed'] = f"{self.status_column_name} = {self.statuses['failed']}"
+        return predicates
+
+    def ensure_indexes(self, concurrently=False):
+        # Частичный индекс только по строкам в очереди: выборка get_task остаётся O(log n),
+        # сколько бы завершённых строк ни было в таблице.
+        predicates = self._partial_predicates()
+        mode = "concurrently " if concurrently else ""
+        statements = [f"create index {mode}if not exists {self._index_name('inqueue_idx')} "
+                      f"on {self.table_name} ({self.id_column_name}) where {predicates['inqueue']}"]
+        if self.lease_column_name:
+            statements.append(f"create index {mode}if not exists {self._index_name('lease_idx')} "
+                              f"on {self.table_name} ({self.lease_column_name}) where {predicates['processing']}")
+        if self.claimed_column_name:
+            statements.append(f"create index {mode}if not exists {self._index_name('claimed_idx')} "
+                              f"on {self.table_name} ({self.claimed_column_name})")
+        statements.append(f"create index {mode}if not exists {self._index_name('failed_idx')} "
+                          f"on {self.table_name} ({self.id_column_name}) where {predicates['failed']}")
+        con = self.db.con
+        if concurrently:
+            # create index concurrently не работает внутри транзакции
+            self.db.commit()
+            con.autocommit = True
+        try:
+            for sql in statements:
+                self.db.execute(sql)
+        finally:
+            if concurrently:
+                con.autocommit = False
+        self.db.commit()
+
+    def stats(self, rate_window=60):
+        # claim_rate - захватов в секунду по всем воркерам за последние rate_window секунд,
+        # считается по claimed_column_name; без этой колонки None.
+        # Точный счёт по каждому частичному индексу отдельно (inqueue - с учётом filter);
+        # processing без индекса аренды не считается (None), completed оценивается по pg_class.reltuples,
+        # чтобы не сканировать всю таблицу.
+        depth = dict.fromkeys(self.statuses, None)
+        depth['completed'] = 0
+        for name, predicate in self._partial_predicates().items():
+            depth[name] = self.db.fetchone(f"select count(*) from {self.table_name} where {predicate}")[0]
+        estimate = self.db.fetchone("select reltuples::bigint from pg_class where oid = %s::regclass",
+                                    [self.table_name])
+        if estimate and estimate[0] > 0:
+            counted = sum(count for name, count in depth.items() if name != 'completed' and count)
+            depth['completed'] = max(estimate[0] - counted, 0)
+
+        age = f"extract(epoch from now() - {self.created_column_name})" if self.created_column_name else "null"
+        oldest = self.db.fetchone(
+            f"select {self.id_column_name}, {age} from {self.table_name} "
+            f"where {self.status_column_name} = {self.statuses['inqueue']} and {self.filter} "
+            f"order by {self.id_column_name} limit 1")
+        claim_rate = None
+        if self.claimed_column_name:
+            claimed = self.db.fetchone(
+                f"select count(*) from {self.table_name} "
+                f"where {self.claimed_column_name} >= now() - %s * interval '1 second'", [float(rate_window)])
+            claim_rate = claimed[0] / rate_window if claimed and rate_window > 0 else 0.0
+        self.db.commit()
+
+        return {
+            "table": self.table_name,
+            "depth": depth,
+            "oldest_inqueue_id": oldest[0] if oldest else None,
+            "oldest_inqueue_age": float(oldest[1]) if oldest and oldest[1] is not None else None,
+            "claimed": self.claimed_total,
+            "claim_rate": claim_rate,
+        }
+
+
+# Исполнитель очереди: handler(task_id) в workers потоках или процессах, у каждого своё соединение.
+# consumer = pgq_consumer(pgdb, 'tbc.import_queue', handle_book, workers=8, lease_column_name='pgq_lease')
+# consumer.run()  # до SIGINT/SIGTERM или consumer.stop()
+# Аренда обязательна: задачи умершего воркера возвращает в очередь reclaim_expired(), его раз в
+# reclaim_interval вызывает сам run(), а не один из воркеров. Ошибка БД у воркера не убивает его:
+# соединение пересоздаётся с паузой от error_backoff до max_error_backoff секунд; умерший воркер run() перезапускает.
+# Если handler упал, задача сразу возвращается в очередь через fail_tasks(); с attempts_column_name
+# после max_attempts неудач она получает статус failed, без счётчика - сразу failed.
+class pgq_consumer:
+    def __init__(self, db_factory, table_name, handler, workers=4, mode='thread', batch_size=10,
+                 wait_timeout=5, reclaim_interval=60, use_notify=True, error_backoff=1, max_error_backoff=60,
+                 **queue_kwargs):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"unknown consumer mode: {mode}")
+        if not queue_kwargs.get('lease_column_name'):
+            raise ValueError("pgq_consumer requires lease_column_name")
+        self.db_factory = db_factory
+        self.table_name = table_name
+        self.handler = handler
+        self.workers = workers
+        self.mode = mode
+        self.batch_size = batch_size
+        self.wait_timeout = wait_timeout
+        self.reclaim_interval = reclaim_interval
+        self.use_notify = use_notify
+        self.error_backoff = error_backoff
+        self.max_error_backoff = max_error_backoff
+        self.queue_kwargs = queue_kwargs
+        if mode == 'process':
+            self._stop_event = multiprocessing.get_context().Event()
+        else:
+            self._stop_event = threading.Event()
+
+    def stop(self, *args):
+        self._stop_event.set()
+
+    def _start_runner(self, number):
+        if self.mode == 'process':
+            runner = multiprocessing.get_context().Process(target=self._work, args=(number,), daemon=True)
+        else:
+            runner = threading.Thread(target=self._work, args=(number,), daemon=True)
+        runner.start()
+        return runner
+
+    def _reclaim(self):
+        try:
+            with self.db_factory() as db:
+                pgq_class(db, self.table_name, **self.queue_kwargs).reclaim_expired()
+        except Exception:
+            logger.exception("%s: reclaim of expired leases failed", self.table_name)
+
+    def run(self):
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, self.stop)
+        try:
+            runners = [self._start_runner(number) for number in range(self.workers)]
+            next_reclaim = time.monotonic()
+            while any(runner.is_alive() for runner in runners) or not self._stop_event.is_set():
+                if not self._stop_event.is_set():
+                    if time.monotonic() >= next_reclaim:
+                        self._reclaim()
+                        next_reclaim = time.monotonic() + self.reclaim_interval
+                    for number, runner in enumerate(runners):
+                        if not runner.is_alive():
+                            logger.warning("%s: consumer worker %s died, restarting", self.table_name, number)
+                            runners[number] = self._start_runner(number)
+                for runner in runners:
+                    runner.join(timeout=0.5 / len(runners))
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def _work(self, number):
+        if self.mode == 'process':
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+        failures = 0
+        while not self._stop_event.is_set():
+            try:
+                with self.db_factory() as db:
+                    queue = pgq_class(db, self.table_name, batch_size=self.batch_size, **self.queue_kwargs)
+                    try:
+                        while not self._stop_event.is_set():
+                            self._poll(queue)
+                            failures = 0
+                    finally:
+                        # соединение вернётся в пул, подписка на канал ему не нужна
+                        if self.use_notify:
+                            try:
+                                queue.unlisten()
+                            except Exception:
+                                logger.warning("%s: unlisten failed", self.table_name, exc_info=True)
+            except Exception:
+                failures += 1
+                delay = min(self.error_backoff * 2 ** (failures - 1), self.max_error_backoff)
+                logger.exception("%s: consumer worker %s failed, retrying in %.1fs", self.table_name, number, delay)
+                self._stop_event.wait(delay)
+
+    def _poll(self, queue):
+        ids = queue.get_tasks()
+        if not ids:
+            if self.use_notify:
+                task = queue.wait_for_task(timeout=self.wait_timeout)
+                ids = [task] if task else []
+            else:
+                self._stop_event.wait(self.wait_timeout)
+        if ids:
+            self._process(queue, ids)
+
+    def _process(self, queue, ids):
+        claimed_at = time.monotonic()
+        done = []
+        failed = []
+        for index, task_id in enumerate(ids):
+            if self._stop_event.is_set():
+                # Необработанный хвост пачки возвращаем в очередь сразу, не дожидаясь истечения аренды.
+                queue.release_tasks(ids[index:])
+                break
+            if queue.lease_column_name and time.monotonic() - claimed_at > queue.lease_seconds / 2:
+                queue.extend_lease(ids[index:])
+                claimed_at = time.monotonic()
+            try:
+                self.handler(task_id)
+            except Exception:
+                logger.exception("%s: task %s failed", self.table_name, task_id)
+                failed.append(task_id)
+                continue
+            done.append(task_id)
+        queue.complete_tasks(done)
+        queue.fail_tasks(failed)
@@ -0,0 +1,171 @@
+import errno
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Ошибки, при которых быстрый путь (link/rename/copy_file_range) невозможен и нужен запасной
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM, errno.EEXIST,
+                    errno.EMLINK, errno.ENOTSUP}
+
+
+# Раскладка файлов книг по хранилищу.
+# На одной ФС: move -> rename, copy -> hardlink только при link_copies=True (по умолчанию копия данных:
+# жёсткая ссылка делит inode с исходником, и перезапись исходника испортила бы книгу в хранилище).
+# Между ФС: copy_file_range, затем sendfile, затем обычное копирование; запись идёт во временный
+# файл рядом с целью и атомарно переименовывается.
+# Запоминаются только родительские каталоги /data/<pool>/<ths> (их мало, каталог книги свой у каждой книги,
+# кеш по ним рос бы без предела): под известным родителем каталог книги создаётся одним mkdir.
+# fsync делается пачкой в flush().
+# placer = file_placer(max_workers=8, fsync=True)
+# results = placer.place_many([(src, target, 'move'), ...])  # target или исключение на каждый элемент
+# Четвёртый элемент задания allow_link=False запрещает hardlink для этого файла (например, для обложек).
+class file_placer:
+    def __init__(self, max_workers=4, fsync=False, link_copies=False, chunk_size=64 * 1024 * 1024):
+        self.max_workers = max_workers
+        self.fsync = fsync
+        self.link_copies = link_copies
+        self.chunk_size = chunk_size
+        self._dirs = set()
+        self._lock = threading.Lock()
+        self._pending_files = set()
+        self._pending_dirs = set()
+
+    def ensure_dir(self, path):
+        parent = os.path.dirname(path)
+        if parent in self._dirs:
+            try:
+                os.mkdir(path)
+                return
+            except FileExistsError:
+                return
+            except FileNotFoundError:
+                # родителя удалили снаружи, создаём путь целиком
+                pass
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._dirs.add(parent)
+
+    def forget_dirs(self):
+        with self._lock:
+            self._dirs.clear()
+
+    def _copy_data(self, src, target):
+        tmp = f"{target}.part"
+        try:
+            with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                self._copy_fd(fsrc.fileno(), fdst.fileno(), size)
+            shutil.copymode(src, tmp)
+            os.replace(tmp, target)
+        except BaseException:
+            # недописанная копия может весить гигабайты, в пуле хранилища её не оставляем
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _copy_fd(self, src_fd, dst_fd, size):
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while copied < size:
+                    sent = os.copy_file_range(src_fd, dst_fd, min(self.chunk_size, size - copied))
+                    if sent == 0:
+                        break
+                    copied += sent
+                if copied >= size:
+                    return
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS or copied:
+                    raise
+        try:
+            while copied < size:
+                sent = os.sendfile(dst_fd, src_fd, copied, min(self.chunk_size, size - copied))
+                if sent == 0:
+                    break
+                copied += sent
+            if copied >= size:
+                return
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS or copied:
+                raise
+        os.lseek(src_fd, copied, os.SEEK_SET)
+        os.lseek(dst_fd, copied, os.SEEK_SET)
+        while True:
+            chunk = os.read(src_fd, min(self.chunk_size, 1024 * 1024))
+            if not chunk:
+                break
+            os.write(dst_fd, chunk)
+
+    def place(self, src, target, mode='move', flush=True, allow_link=True):
+        if mode not in ('move', 'copy'):
+            raise NameError(f"import_type not recognised : {mode}")
+        directory = os.path.dirname(target)
+        self.ensure_dir(directory)
+        fast = False
+        try:
+            if mode == 'move':
+                os.rename(src, target)
+                fast = True
+            elif self.link_copies and allow_link:
+                os.link(src, target)
+                fast = True
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+        if not fast:
+            self._copy_data(src, target)
+            if mode == 'move':
+                os.unlink(src)
+        if self.fsync:
+            with self._lock:
+                if not fast:
+                    self._pending_files.add(target)
+                self._pending_dirs.add(directory)
+                if mode == 'move':
+                    self._pending_dirs.add(os.path.dirname(os.path.abspath(src)))
+            if flush:
+                self.flush()
+        return target
+
+    def flush(self):
+        # fsync каталогов (и файлов, если есть) один раз на пачку
+        with self._lock:
+            files, self._pending_files = self._pending_files, set()
+            dirs, self._pending_dirs = self._pending_dirs, set()
+        for path in files:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for path in dirs:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _place_job(self, job):
+        try:
+            src, target, mode = job[:3]
+            return self.place(src, target, mode, flush=False, allow_link=job[3] if len(job) > 3 else True)
+        except Exception as e:
+            return e
+
+    def place_many(self, jobs):
+        # jobs: [(src, target, mode[, allow_link])]; порядок результатов совпадает с порядком jobs
+        jobs = list(jobs)
+        if len(jobs) <= 1 or self.max_workers <= 1:
+            results = [self._place_job(job) for job in jobs]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(self._place_job, jobs))
+        if self.fsync:
+            self.flush()
+        return results
@@ -8,6 +8,11 @@ import random
 from PIL import Image
 import re
 import time
+import threading
+import logging
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from psycopg2.extras import Json 
 from datetime import datetime
 
@@ -22,25 +27,300 @@ from tbclibs.websearch_class import websearch_class
 
 
 from tbclibs.pgdb_class import pgdb
+from tbclibs.placement_class import file_placer
+from tbclibs.hash_class import md5_file, hash_files
+
+logger = logging.getLogger(__name__)
+
+
+# Время этапов одного импорта: {'reload_check': 0.002, 'insert': 0.010, ...} в секундах.
+class stage_timer:
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started
+
+    def total(self):
+        return sum(self.timings.values())
+
+
+# Накопленная по прогону статистика этапов: процентили по последним max_samples замерам.
+# TBC.timings.percentiles() -> {'insert': {'count': 1000, 'p50': ..., 'p90': ..., 'p99': ..., 'max': ...}}
+class timing_stats:
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = {}
+
+    def add(self, timings):
+        with self._lock:
+            for name, seconds in timings.items():
+                if name not in self._samples:
+                    self._samples[name] = deque(maxlen=self.max_samples)
+                    self._counts[name] = 0
+                self._samples[name].append(seconds)
+                self._counts[name] += 1
+
+    def percentiles(self, ps=(50, 90, 99)):
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            counts = dict(self._counts)
+        result = {}
+        for name, values in samples.items():
+            stats = {'count': counts[name], 'max': values[-1]}
+            for p in ps:
+                stats[f"p{p}"] = values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+            result[name] = stats
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+            self._counts = {}
+
 
 def  get_tbc_id():
-    pg = pgdb()
-    id=pg.fetchone("SELECT nextval('tbc.books_id_seq')")[0]
-    pg.close()
+    id = TBC.id_allocator.take()
+    if id is None:
+        with pgdb() as pg:
+            id = TBC.id_allocator.next_id(pg)
     return id
 
 
+# Определение языка: один LangDetect на процесс и LRU-мемо по нормализованной строке
+# (в сериях одинаковые title/author встречаются много раз).
+LANG_MEMO_SIZE = 20000
+_lang_detector = None
+_lang_lock = threading.Lock()
+_lang_memo = OrderedDict()
+
+
+def get_lang_detector():
+    global _lang_detector
+    if _lang_detector is None:
+        with _lang_lock:
+            if _lang_detector is None:
+                _lang_detector = LangDetect()
+    return _lang_detector
+
+
+def lang_input(params):
+    # пустые и None-поля пропускаем, остальное приводим к строке
+    str4detect = ''
+    for par in ['title', 'author', 'filename']:
+        if params.get(par):
+            str4detect += " " + str(params[par])
+    return str4detect
+
+
+def _normalize_lang_input(text):
+    return " ".join(text.split())
+
+
+def _detect_uncached(text):
+    try:
+        return get_lang_detector().detect(text)
+    except Exception as e:
+        logger.warning("error detect: %s", e)
+        return None
+
+
+def _remember_lang(key, lang):
+    with _lang_lock:
+        _lang_memo[key] = lang
+        _lang_memo.move_to_end(key)
+        while len(_lang_memo) > LANG_MEMO_SIZE:
+            _lang_memo.popitem(last=False)
+
+
+def _cached_lang(key):
+    with _lang_lock:
+        if key in _lang_memo:
+            _lang_memo.move_to_end(key)
+            return True, _lang_memo[key]
+    return False, None
+
+
+def detect_lang(text):
+    key = _normalize_lang_input(text)
+    found, lang = _cached_lang(key)
+    if not found:
+        lang = _detect_uncached(key)
+        _remember_lang(key, lang)
+    return lang
+
+
+def detect_many(texts, processes=None, chunksize=64, min_parallel=256):
+    # Языки для списка строк в том же порядке. Уникальные непрокешированные строки
+    # при большом объёме раздаются пулу процессов (в каждом свой LangDetect).
+    keys = [_normalize_lang_input(text) for text in texts]
+    results = {}
+    missing = []
+    for key in dict.fromkeys(keys):
+        found, lang = _cached_lang(key)
+        if found:
+            results[key] = lang
+        else:
+            missing.append(key)
+    if len(missing) >= min_parallel and processes != 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            detected = list(executor.map(_detect_uncached, missing, chunksize=chunksize))
+    else:
+        detected = [_detect_uncached(key) for key in missing]
+    for key, lang in zip(missing, detected):
+        _remember_lang(key, lang)
+        results[key] = lang
+    return [results[key] for key in keys]
+
+
+# Выдаёт id книг из заранее зарезервированного блока значений tbc.books_id_seq:
+# один запрос на block_size книг вместо nextval на каждую. Общий для всех потоков процесса,
+# неиспользованные id при падении просто пропадают (дырки в последовательности допустимы).
+class tbc_id_allocator:
+    def __init__(self, block_size=100):
+        self.block_size = block_size
+        self._ids = deque()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        # дочерний процесс не должен раздавать id, зарезервированные родителем
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._ids.clear()
+
+    def take(self):
+        with self._lock:
+            self._check_fork()
+            if self._ids:
+                return self._ids.popleft()
+            return None
+
+    def _reserve(self, db, count):
+        rows = db.fetchall("select nextval('tbc.books_id_seq') from generate_series(1, %s)", [count])
+        self._ids.extend(sorted(row[0] for row in rows))
+
+    def next_id(self, db):
+        with self._lock:
+            self._check_fork()
+            if not self._ids:
+                self._reserve(db, self.block_size)
+            return self._ids.popleft()
+
+    def next_ids(self, db, count):
+        with self._lock:
+            self._check_fork()
+            if len(self._ids) < count:
+                self._reserve(db, max(count - len(self._ids), self.block_size))
+            return [self._ids.popleft() for _ in range(count)]
+
+
+
+# Кеш редко меняющихся справочников: активный storage pool и карта book_locator (th -> location).
+# Загружается целиком одним заходом, после ttl секунд обновляется в фоновом потоке
+# (до окончания обновления отдаются старые значения). invalidate() сбрасывает кеш.
+class tbc_lookup_cache:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._refreshing = False
+        self._active_pool = None
+        self._locations = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def load(self, db):
+        row = db.fetchone_dict("select name from storage_pools where is_active=True")
+        locations = dict(db.fetchall("select th, location from book_locator"))
+        with self._lock:
+            self._active_pool = row["name"] if row else None
+            self._locations = locations
+            self._loaded_at = time.monotonic()
+
+    def _refresh_in_background(self, db_factory):
+        # db_factory — класс соединения вызывающего (type(db)), уже настроенный configure_pgdb
+        try:
+            with db_factory() as db:
+                self.load(db)
+        except Exception as e:
+            logger.exception("error refresh lookup cache: %s", e)
+            # следующая попытка не раньше чем через ttl, а не на каждом обращении
+            with self._lock:
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _ensure(self, db):
+        with self._lock:
+            loaded_at = self._loaded_at
+            expired = loaded_at is not None and time.monotonic() - loaded_at > self.ttl
+            if expired and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_in_background, args=(type(db),), daemon=True).start()
+        if loaded_at is None:
+            self.load(db)
+
+    def active_pool(self, db):
+        self._ensure(db)
+        if not self._active_pool:
+            raise NameError("Нет активного storage pool")
+        return self._active_pool
+
+    def location(self, db, th):
+        self._ensure(db)
+        location = self._locations.get(th)
+        if location is None:
+            # th мог появиться после загрузки кеша
+            row = db.fetchone("select location from book_locator where th=%s", [th])
+            if row:
+                location = row[0]
+                with self._lock:
+                    self._locations[th] = location
+        return location
+
+
+def shorten_string(input_string, max_length=500):
+    names = input_string.split(',')  # Разделяем строку по запятой
+    shortened_string = ""
+
+    for name in names:
+        name = name.strip()  # Убираем пробелы вокруг имени
+        # Проверяем, добавление очередного имени не превысит 500 символов
+        if len(shortened_string) + len(name) + (1 if shortened_string else 0) < max_length:
+            if shortened_string:  # Если не пустая строка, добавляем запятую
+                shortened_string += ', '
+            shortened_string += name
+        else:
+            break  # Если превышает 500 символов, прекращаем добавление
+
+    return shortened_string
+
 
 class TBC:
     storage_base = '/data'
+    id_allocator = tbc_id_allocator()
+    lookup_cache = tbc_lookup_cache()
+    placer = file_placer()
+    timings = timing_stats()
+    batch_timings = timing_stats()
+    last_timings = None
 
     def __init__(self, db):
         self.db = db
 
     def  get_new_tbc_id(self):
-        pg = self.db
-        id=pg.fetchone("SELECT nextval('tbc.books_id_seq')")[0]
-        return id
+        return self.id_allocator.next_id(self.db)
 
     def get_id_by_hash(self, md5):
         sql = "select * from books where md5=%s and reload=0"
@@ -56,296 +336,359 @@ class TBC:
 
     def get_locator(self, id):
         th = math.floor(id / 1000) * 1000
-        print(f"th={th}")
-        sql = "select location from book_locator where th=%s"
-        row = self.db.fetchone(sql, [th])
-        if len(row) == 0:
-            print(f"th={th}")
+        location = self.lookup_cache.location(self.db, th)
+        if location is None:
             raise NameError(f"Не определена локация для id = {id}")
-        return row[0]
-
+        return location
 
-    def import_file(self, params):
-
-        def shorten_string(input_string, max_length=500):
-            names = input_string.split(',')  # Разделяем строку по запятой
-            shortened_string = ""
-            
-            for name in names:
-                name = name.strip()  # Убираем пробелы вокруг имени
-                # Проверяем, добавление очередного имени не превысит 500 символов
-                if len(shortened_string) + len(name) + (1 if shortened_string else 0) < max_length:
-                    if shortened_string:  # Если не пустая строка, добавляем запятую
-                        shortened_string += ', '
-                    shortened_string += name
-                else:
-                    break  # Если превышает 500 символов, прекращаем добавление
 
-            return shortened_string
+    def _check_params(self, params):
         if not 'import_file' in params:
             raise NameError(f"Опущен обязательный парамет:  import_file")
         if not os.path.isfile(params['import_file']):
             raise NameError(f"при импорте нет файла {params['import_file']}")
         if 'md5' not in params:
-            raise NameError(f"нужно передать md5")
-        pars = []
-        vals = []
-        p = []
-        data = {}
-
-
+            params['md5'] = md5_file(params['import_file'])
+        if params.get('import_type', 'move') not in ('move', 'copy'):
+            raise NameError(f"import_type not recognised : {params['import_type']}")
 
         file = os.path.basename(params['import_file'])
         (file_name, file_ext) = os.path.splitext(file)
         if 'filename' not in params:
             params['filename'] = file_name
-
         if 'extension' not in params:
             params['extension'] = file_ext.strip('.').strip().lower()
 
-        file_size = os.path.getsize(params['import_file'])
+        if 'title' in params and len(params['title']) > 1000:
+            params['title'] = params['title'][0:1000]
+        if 'isbn' in params and len(params['isbn']) > 300:
+            params['isbn'] = params['isbn'][0:300]
+        if 'pages' in params and len(params['pages']) > 100:
+            params['pages'] = params['pages'][:100]
+        if params.get('publisher') and len(params['publisher']) > 500:
+            if "," in params['publisher']:
+                params['publisher'] = shorten_string(params['publisher'], 500)
+            else:
+                params['publisher'] = params['publisher'][:500]
+
+    def _location(self, new_id, locator_id):
+        ths = math.floor(new_id / 1000) * 1000
+        return os.path.join(self.storage_base, locator_id, str(ths), str(new_id))
+
+    def _target_path(self, params, location):
+        # Полный путь не длиннее MAX_LEN: при необходимости укорачиваем filename в params
+        # (до записи в books, чтобы не делать отдельный update).
+        short_filename = f"{params['filename']}.{params['extension']}"
+        target = f"{location}/{short_filename}"
+
+        MAX_LEN = 100
+        if len(target) > MAX_LEN:
+            max_len = MAX_LEN - len(location) - 1
+            (file_name, file_ext) = os.path.splitext(short_filename)
+            file_ext = file_ext.replace(".", "")
+            file_name = file_name[0:max_len]
+            short_filename = file_name + "." + file_ext
+            target = f"{location}/{short_filename}"
+            logger.info("shortened name: %s", target)
+            params['filename'] = file_name
+            params['extension'] = file_ext
+        return target
+
+    def _book_values(self, params, new_id, reload_row, locator_id, lang):
+        pars = []
+        vals = []
+
         pars.append('filesize')
-        vals.append(file_size)
-        p.append('%s')
-        
-        # Смотрим не восстановление ли это потерянной книги
-        sql = "select * from books where md5=%s"
-        reload_row = self.db.fetchone_dict(sql, [params['md5']])
-        if reload_row and reload_row["reload"] == 1:
-            reload=True
-        else:
-            reload=False
+        vals.append(os.path.getsize(params['import_file']))
 
-        if reload:
-            #book = self.get_id_by_hash(params['md5'])
-            new_id = reload_row["id"]
+        if reload_row:
             pars.append('reload')
-            vals.append(0)       
-
-            # select nextval('tbc.books_id_seq')
-            # sql = "select max(id) from books"
-
-            # плохо работает в многопотоке
-            # sql = "select nextval('books_id_seq')"
-            # id = self.db.fetchone(sql)[0]
-
-            # print("start get ID", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            # sql = f"""
-            #     with next_task as (                                                                                                                                                                                                                                                   
-            #     select id from books_ids_pool where status = 0 order by id limit 1 
-            #     for update skip locked )                                                                                                                                            
-            #     update books_ids_pool  set status = 1 from next_task  
-            #     where books_ids_pool.id = next_task.id                                                                                                                      
-            #     returning next_task.id
-            #     """
-            # row = self.db.fetchone(sql)
-            # self.db.commit()
-            # print("End get ID", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            # if row:
-            #     new_id=row[0]
-            #     print(f"NEW ID = ", new_id)
-                
+            vals.append(0)
         else:
-            #new_id = self.get_new_tbc_id()
-            new_id = self.db.fetchone("SELECT nextval('tbc.books_id_seq')")[0]
-            #new_id = int(id) + 1
             pars.append('id')
             vals.append(new_id)
-            p.append('%s')
 
-        
-        ths = math.floor(new_id / 1000) * 1000
         pars.append('ths')
-        vals.append(ths)
-        p.append('%s')
-        #locator = self.get_locator(new_id)
-
-        
-        
+        vals.append(math.floor(new_id / 1000) * 1000)
 
-        if reload:
-            locator_id=reload_row["locator_id"]
-        else:
-            locator_id = self.db.fetchone_dict("select name from storage_pools where is_active=True")["name"]
-            #book_locator_row = self.db.fetchone_dict("select * from book_locator where th=%s", [ths])
-            #locator_id=book_locator_row["pool"]
+        if not reload_row:
             pars.append('locator_id')
             vals.append(locator_id)
-            p.append('%s')
-
 
-        if reload:
-            location = os.path.join(self.storage_base, reload_row["locator_id"], str(ths), str(new_id))
-        else:
-            location = os.path.join(self.storage_base, locator_id, str(ths) , str(new_id))
-
-
-        if 'title' in params and len(params['title']) > 1000:
-            params['title'] = params['title'][0:1000]
         for par in ['filename', 'extension', 'src_type', 'src_id', 'library', 'src_add_algorithm', 'year', 'num',
                     'book_type', 'pages', 'title', 'author', 'reload', 'md5', 'isbn', 'descr', 'params_json',
                     'textlayer_enable', 'textlayer_size', 'cover_small', 'flags', 'publisher', 'parent_id']:
             if par in params:
-                # print(f"+++par: {par}")
-                if par == 'isbn' and len(params[par]) > 300:
-                    params[par] = params[par][0:300]
-                if par == 'pages' and len(params[par]) >100:
-                    params[par]=params[par][:100]
-                # if par == "params_json":
-                #     params[par] = json.dumps(params[par], indent=4, sort_keys=True, default=str)
-                # if par == "flags" and params[par]:
-                #     #params[par] = json.dumps(params[par], sort_keys=True, default=str)
-                #     params[par] = json.dumps(params[par])
-                #     #params[par] = Json(params[par])
-                if par == "publisher" and params[par]:
-                    if len(params[par])>500:
-                        if "," in params[par]:
-                            params[par]=shorten_string(params[par],500)
-                        else:
-                            params[par]=params[par][:500]
-
                 pars.append(par)
                 vals.append(params[par])
-                p.append('%s')
-
-
-
-        ld = LangDetect()
-        try:
-            str4detect = ''
-            for par in ['title', 'author', 'filename']:
-                if par in params:
-                    str4detect += " " + params[par]
-            lang = ld.detect(f"{str4detect}")
-        except Exception as e:
-            print("error detect : " + str(e))
-            lang = None
-        print(f"detectied lang: {lang}")
 
         pars.append('download_hash')
         vals.append(''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(15)))
-        p.append('%s')
 
         if lang:
             pars.append('detected_lang')
             vals.append(lang)
-            p.append('%s')
             if lang in ['russian', 'english', 'bulgarian']:
                 if lang == 'bulgarian':
                     lang = 'russian'
                 pars.append("search_lang_regconfig")
                 vals.append(lang)
-                p.append('%s')
                 if lang == 'russian':
                     pars.append("search_updated")
                     vals.append(1)
-                    p.append('%s')
-
-        print(f"pars: ", pars)
-        print(f"vals: ", vals)
-        print(f"p: ", p)
-
-        #sys.exit()
-        if reload:
-            update_pars = []
-            for par in pars:
-                update_pars.append(f"{par}=%s")
+        return pars, vals
 
-            sql = "update books set {} where id={}".format(",".join(update_pars), new_id)
-            self.db.execute(sql, vals)
-        else:
-            sql = "insert into books ({}) values ({})".format(",".join(pars), ",".join(p))
-            print(sql)
-            print(vals)
-            self.db.execute(sql, vals)
-            # if 'flags' in params:
-            #     self.db.execute("update books set flags=%s where id=%s", [params['flags'], new_id])
+    def _placement_jobs(self, params, location, target):
+        jobs = [(params['import_file'], target, params.get('import_type', 'move'), True)]
+        if 'cover_file' in params:
+            # обложку всегда копируем: вызывающий часто переиспользует временный файл
+            jobs.append((params['cover_file'], f"{location}/cover_small.jpg", 'copy', False))
+        return jobs
 
-        print(f"new_id: {new_id}")
+    def _place_file(self, params, location, target):
+        logger.debug("move file to %s", target)
+        for src, dst, mode, allow_link in self._placement_jobs(params, location, target):
+            self.placer.place(src, dst, mode, allow_link=allow_link)
 
-        print(f"move file to {location}")
+    def _cleanup_reloaded(self, ids):
+        for table in ['books_images', 'books_images_cache', 'books_textlayers', 'books_textlayers_cache',
+                      'finereader_queue']:
+            self.db.execute(f"delete from {table} where tbc_id = any(%s)", [ids])
 
+    def import_file(self, params):
+        timer = stage_timer()
+        self._check_params(params)
+
+        with timer.stage('reload_check'):
+            # Смотрим не восстановление ли это потерянной книги
+            sql = "select * from books where md5=%s"
+            reload_row = self.db.fetchone_dict(sql, [params['md5']])
+            if not (reload_row and reload_row["reload"] == 1):
+                reload_row = None
+
+        with timer.stage('id_allocation'):
+            if reload_row:
+                new_id = reload_row["id"]
+                locator_id = reload_row["locator_id"]
+            else:
+                new_id = self.get_new_tbc_id()
+                locator_id = self.lookup_cache.active_pool(self.db)
+        location = self._location(new_id, locator_id)
+        target = self._target_path(params, location)
+
+        with timer.stage('lang_detect'):
+            if 'detected_lang' in params:
+                # уже определён пакетно, см. detect_many
+                lang = params.pop('detected_lang')
+            else:
+                lang = detect_lang(lang_input(params))
+        logger.debug("detected lang: %s", lang)
+
+        with timer.stage('insert'):
+            pars, vals = self._book_values(params, new_id, reload_row, locator_id, lang)
+            logger.debug("pars: %s vals: %s", pars, vals)
+
+            if reload_row:
+                update_pars = []
+                for par in pars:
+                    update_pars.append(f"{par}=%s")
+
+                sql = "update books set {} where id={}".format(",".join(update_pars), new_id)
+                self.db.execute(sql, vals)
+            else:
+                sql = "insert into books ({}) values ({})".format(",".join(pars), ",".join(['%s'] * len(pars)))
+                self.db.execute(sql, vals)
+
+        logger.debug("new_id: %s", new_id)
+        with timer.stage('placement'):
+            self._place_file(params, location, target)
+        with timer.stage('insert'):
+            self.db.commit()
 
+        with timer.stage('verification'):
+            new_book = self.get_book_by_hash_dict(params['md5'])
 
-        os.makedirs(location, exist_ok=True)
+            if not os.path.isfile(f"{location}/{new_book['filename']}.{new_book['extension']}"):
+                raise NameError(f"Файл не найден в новом месте {location}/{new_book['filename']}.{new_book['extension']}")
 
-        if 'filename' in params and 'extension' in params:
-            short_filename = f"{params['filename']}.{params['extension']}"
-        else:
-            short_filename = f"{file}"
-        target = f"{location}/{short_filename}"
+        with timer.stage('cleanup'):
+            if reload_row:
+                logger.info("reload %s", new_id)
+                self._cleanup_reloaded([new_id])
 
-        MAX_LEN = 100
-        if len(target) > MAX_LEN:
-            max_len = MAX_LEN - len(location) - 1
-            (file_name, file_ext) = os.path.splitext(short_filename)
-            file_ext = file_ext.replace(".", "")
-            file_name = file_name[0:max_len]
-            short_filename = file_name + "." + file_ext
-            target = f"{location}/{short_filename}"
-            print(f"Shorted name: {target}")
-            params['filename'] = file_name
-            params['extension'] = file_ext
-            self.db.execute("update books set filename=%s where id=%s", [file_name, new_id])
+            sql = "delete from books_ids_pool where id=%s"
+            self.db.execute(sql, [new_id])
             self.db.commit()
-            # sys.exit()
-            # time.sleep(3)
-
-        print(f"target: {target}")
-
+            book = self.db.fetchone_dict("select * from books where id=%s", [new_id])
+        self._finish_timing(timer, f"book {new_id}", self.timings)
+        return book
+
+    def _finish_timing(self, timer, label, stats):
+        self.last_timings = timer.timings
+        stats.add(timer.timings)
+        logger.info("imported %s in %.3fs", label, timer.total(),
+                    extra={'timings': timer.timings})
+
+    def import_files(self, list_of_params, lang_processes=None, hash_processes=None):
+        timer = stage_timer()
+        # Пакетный импорт: id одним запросом, reload одной выборкой md5 = any(...),
+        # новые книги одним многострочным insert и одна транзакция на всю пачку.
+        # Файлы раскладываются после commit; ошибка одного файла не прерывает пачку.
+        # Возвращает отчёт по каждому элементу: {"index", "md5", "status": ok|duplicate|error, "id", "book"|"error"}.
+        # md5, которые не передали, считаем сразу для всей пачки в пуле процессов
+        with timer.stage('hash'):
+            unhashed = [params for params in list_of_params
+                        if 'md5' not in params and os.path.isfile(params.get('import_file', ''))]
+            # list(): генератор держит пул процессов открытым, пока его не дочитают
+            hashed = list(hash_files([params['import_file'] for params in unhashed], processes=hash_processes))
+            for params, (_, md5) in zip(unhashed, hashed):
+                if not isinstance(md5, Exception):
+                    params['md5'] = md5
+
+        report = [{"index": index, "md5": params.get('md5'), "status": None} for index, params in
+                  enumerate(list_of_params)]
+        items = []
+        seen_md5 = set()
+        for entry, params in zip(report, list_of_params):
+            try:
+                self._check_params(params)
+            except Exception as e:
+                entry.update(status="error", error=str(e))
+                continue
+            if params['md5'] in seen_md5:
+                entry.update(status="duplicate", error=f"md5 {params['md5']} повторяется в пачке")
+                continue
+            seen_md5.add(params['md5'])
+            items.append((entry, params))
+        if not items:
+            return report
 
+        try:
+            with timer.stage('reload_check'):
+                md5s = sorted(params['md5'] for _, params in items)
+                # Блокировки по md5 до commit вставки: параллельные импортёры не вставят один файл дважды.
+                # Сортировка задаёт общий порядок захвата и исключает взаимоблокировки.
+                self.db.fetchall("select pg_advisory_xact_lock(hashtext(md5)) "
+                                 "from unnest(%s::text[]) with ordinality as m(md5, n) order by n", [md5s])
+                existing = {row['md5']: row for row in self.db.fetchall_dict(
+                    "select * from books where md5 = any(%s)", [md5s])}
+            new_items = []
+            reload_items = []
+            for entry, params in items:
+                row = existing.get(params['md5'])
+                if row is None:
+                    new_items.append((entry, params))
+                elif row['reload'] == 1:
+                    reload_items.append((entry, params, row))
+                else:
+                    entry.update(status="duplicate", id=row['id'], error=f"книга с md5 {params['md5']} уже есть")
+
+            with timer.stage('lang_detect'):
+                langs = detect_many([lang_input(params) for _, params in
+                                     new_items + [(e, p) for e, p, _ in reload_items]], processes=lang_processes)
+            with timer.stage('id_allocation'):
+                new_ids = self.id_allocator.next_ids(self.db, len(new_items)) if new_items else []
+                locator_id = self.lookup_cache.active_pool(self.db) if new_items else None
+
+            with timer.stage('insert'):
+                placements = []
+                groups = {}
+                updates = []
+                # Подготовка строк по одной: файл мог исчезнуть после _check_params (getsize),
+                # такая книга получает error, остальные идут дальше.
+                for (entry, params), new_id, lang in zip(new_items, new_ids, langs):
+                    try:
+                        location = self._location(new_id, locator_id)
+                        target = self._target_path(params, location)
+                        pars, vals = self._book_values(params, new_id, None, locator_id, lang)
+                    except Exception as e:
+                        entry.update(status="error", error=str(e))
+                        continue
+                    groups.setdefault(tuple(pars), []).append(vals)
+                    placements.append((entry, params, new_id, location, target, None))
+                for (entry, params, row), lang in zip(reload_items, langs[len(new_items):]):
+                    try:
+                        location = self._location(row['id'], row['locator_id'])
+                        target = self._target_path(params, location)
+                        pars, vals = self._book_values(params, row['id'], row, row['locator_id'], lang)
+                    except Exception as e:
+                        entry.update(status="error", id=row['id'], error=str(e))
+                        continue
+                    updates.append((pars, vals, row['id']))
+                    placements.append((entry, params, row['id'], location, target, row))
+                try:
+                    for pars, rows in groups.items():
+                        self.db.insert_many('books', pars, rows)
+                    for pars, vals, book_id in updates:
+                        sql = "update books set {} where id=%s".format(",".join(f"{par}=%s" for par in pars))
+                        self.db.execute(sql, vals + [book_id])
+                    self.db.commit()
+                except Exception as e:
+                    self.db.rollback()
+                    logger.warning("batch insert failed, importing one by one: %s", e)
+                    # Откатываем пачку и импортируем по одной, чтобы ошибка одной строки не валила остальные.
+                    for entry, params in items:
+                        if entry["status"] is not None:
+                            continue
+                        try:
+                            book = self.import_file(params)
+                            entry.update(status="ok", id=book['id'], book=book)
+                        except Exception as item_error:
+                            self.db.rollback()
+                            entry.update(status="error", error=str(item_error))
+                    return report
+        except BaseException:
+            # Не оставляем открытую транзакцию с advisory-блокировками
+            self.db.rollback()
+            raise
+
+        # Все файлы пачки раскладываются параллельно, fsync — один раз в конце.
+        with timer.stage('placement'):
+            jobs = []
+            job_owner = []
+            for number, (entry, params, book_id, location, target, reload_row) in enumerate(placements):
+                for job in self._placement_jobs(params, location, target):
+                    jobs.append(job)
+                    job_owner.append(number)
+            errors = {}
+            for number, result in zip(job_owner, self.placer.place_many(jobs)):
+                if isinstance(result, Exception):
+                    errors.setdefault(number, result)
+
+        with timer.stage('verification'):
+            placed_ids = []
+            failed_new_ids = []
+            failed_reload_ids = []
+            for number, (entry, params, book_id, location, target, reload_row) in enumerate(placements):
+                entry["id"] = book_id
+                error = errors.get(number)
+                if error is None and not os.path.isfile(target):
+                    error = NameError(f"Файл не найден в новом месте {target}")
+                if error is not None:
+                    entry.update(status="error", error=str(error))
+                    (failed_reload_ids if reload_row else failed_new_ids).append(book_id)
+                    continue
+                entry["status"] = "ok"
+                placed_ids.append(book_id)
+
+        with timer.stage('cleanup'):
+            # Не разложенные файлы: новые строки удаляем, восстановление помечаем обратно как reload.
+            if failed_new_ids:
+                self.db.execute("delete from books where id = any(%s)", [failed_new_ids])
+            if failed_reload_ids:
+                self.db.execute("update books set reload=1 where id = any(%s)", [failed_reload_ids])
+            reloaded_ids = [book_id for _, _, book_id, _, _, reload_row in placements
+                            if reload_row and book_id in placed_ids]
+            if reloaded_ids:
+                self._cleanup_reloaded(reloaded_ids)
+            if placed_ids:
+                self.db.execute("delete from books_ids_pool where id = any(%s)", [placed_ids])
+            self.db.commit()
 
-        # sys.exit()
-        # flags = {}
-        # if 'flags' in params:
-        #     flags = json.loads(params['flags'])
-        # print(f"--->>>> {flags}")
-        import_type = 'move'
-        if 'import_type' in params:
-            import_type = params['import_type']
-        if import_type == 'move':
-            shutil.move(params['import_file'], target)
-        elif import_type == 'copy':
-            shutil.copy(params['import_file'], target)
-        else:
-            print(f"!!! import_type ont recognised : {import_type}")
-            sys.exit()
-        # if 'textlayer_file' in params:
-        #     shutil.copy(params['textlayer_file'], f"{location}/textlayer.txt")
-        #     flags['textlayer_file'] = 'textlayer.txt'
-        #     if 'textlayer_enable' in params:
-        #         flags['textlayer_enable'] = params['textlayer_enable']
-        #     if 'textlayer_size' in params:
-        #         flags['textlayer_size'] = params['textlayer_size']
-
-        if 'cover_file' in params:
-            shutil.copy(params['cover_file'], f"{location}/cover_small.jpg")
-
-        # shutil.copyfile(pars['import_file'], )
-        # self.db.commit()
-        # new_book = self.get_book_by_hash_dict(params['md5'])
-        # f = new_book['flags']
-        # if not f:
-        #     f = {}
-        # f = f.update(flags)
-        # self.db.execute("update books set flags=%s where id=%s", [json.dumps(flags), new_id])
-        self.db.commit()
-
-        new_book = self.get_book_by_hash_dict(params['md5'])
-
-        if not os.path.isfile(f"{location}/{new_book['filename']}.{new_book['extension']}"):
-            raise NameError(f"Файл не найден в новом месте {location}/{new_book['filename']}.{new_book['extension']}")
-        print(params)
-        if reload:
-            print("reload")
-            self.db.execute("delete from books_images where tbc_id=%s", [new_id])
-            self.db.execute("delete from books_images_cache where tbc_id=%s", [new_id])
-            self.db.execute("delete from books_textlayers where tbc_id=%s", [new_id])
-            self.db.execute("delete from books_textlayers_cache where tbc_id=%s", [new_id])
-            self.db.execute("delete from finereader_queue where tbc_id=%s", [new_id])
-
-            # sys.exit()
-        sql = "delete from books_ids_pool where id=%s"
-        self.db.execute(sql, [new_id])
-        self.db.commit()
-        return self.db.fetchone_dict("select * from books where id=%s", [new_id])
+        books = {book['id']: book for book in self.db.fetchall_dict(
+            "select * from books where id = any(%s)", [placed_ids])} if placed_ids else {}
+        for entry in report:
+            if entry["status"] == "ok":
+                entry["book"] = books.get(entry["id"])
+        self._finish_timing(timer, f"batch of {len(placed_ids)} books", self.batch_timings)
+        return report
@@ -22,3 +22,19 @@ def test_health_endpoint(client):
     response = client.get("/api/health")
     assert response.status_code == 200
     assert response.get_json() == {"status": "ok"}
+
+
+def test_db_metrics_endpoint(client):
+    from libs.pgdb_class import pgdb
+
+    pgdb.STATS.reset()
+    pgdb.STATS.record("select * from books where md5=%s", 0.002, 1)
+
+    response = client.get("/api/db-metrics?reset=1")
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["status"] == "ok"
+    assert data["queries"][0]["sql"] == "select * from books where md5=?"
+    assert data["queries"][0]["calls"] == 1
+    assert pgdb.STATS.snapshot() == []
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import pytest
+
+from app import create_app
+from app.cli import CHECKPOINT_NAME, _scan
+from app.config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite+pysqlite:///:memory:"
+
+
+@pytest.fixture()
+def runner():
+    app = create_app(TestConfig())
+    return app.test_cli_runner()
+
+
+def test_scan_walks_tree_and_skips_finished_files(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "b").mkdir()
+    (tmp_path / "a" / "b" / "book1.pdf").write_text("1")
+    (tmp_path / "a" / "book2.pdf").write_text("2")
+    (tmp_path / "book3.pdf").write_text("3")
+    (tmp_path / CHECKPOINT_NAME).write_text("")
+
+    found = sorted(_scan(str(tmp_path), skip={str(tmp_path / "book3.pdf")}))
+
+    assert found == [str(tmp_path / "a" / "b" / "book1.pdf"), str(tmp_path / "a" / "book2.pdf")]
+
+
+def test_ingest_resumes_from_checkpoint(runner, tmp_path):
+    (tmp_path / "book.pdf").write_text("done")
+    (tmp_path / CHECKPOINT_NAME).write_text(f"{tmp_path / 'book.pdf'}\n")
+
+    result = runner.invoke(args=["tbc", "ingest", str(tmp_path)])
+
+    assert result.exit_code == 0
+    assert "0 files to import" in result.output
+
+
+def test_ingest_aborts_when_setup_fails(runner, tmp_path):
+    (tmp_path / "book.pdf").write_text("new")
+
+    result = runner.invoke(args=["tbc", "ingest", str(tmp_path), "--workers", "1"])
+
+    assert result.exit_code == 1
+    assert "ingest setup failed" in result.output
+
+
+def test_ingest_aborts_when_worker_setup_fails(runner, tmp_path, monkeypatch):
+    (tmp_path / "book.pdf").write_text("new")
+    monkeypatch.setattr("app.cli._preflight", lambda db_factory: None)
+
+    result = runner.invoke(args=["tbc", "ingest", str(tmp_path), "--workers", "1"])
+
+    assert result.exit_code == 1
+    assert "ingest worker setup failed" in result.output
+    assert not (tmp_path / CHECKPOINT_NAME).read_text()
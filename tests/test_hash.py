@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import hashlib
+import os
+
+from libs.hash_class import hash_files, md5_file, quick_hash
+
+
+def test_md5_file_matches_hashlib_for_buffer_and_mmap(tmp_path):
+    data = os.urandom(1_000_003)
+    path = tmp_path / "book.pdf"
+    path.write_bytes(data)
+    expected = hashlib.md5(data).hexdigest()
+
+    assert md5_file(str(path), buffer_size=4096) == expected
+    assert md5_file(str(path), use_mmap=True) == expected
+
+
+def test_quick_hash_distinguishes_size_and_tail(tmp_path):
+    first = tmp_path / "a.bin"
+    second = tmp_path / "b.bin"
+    first.write_bytes(b"x" * 200_000 + b"a")
+    second.write_bytes(b"x" * 200_000 + b"b")
+
+    assert quick_hash(str(first)) != quick_hash(str(second))
+
+
+def test_hash_files_keeps_order_and_reports_errors(tmp_path):
+    paths = []
+    for index in range(3):
+        path = tmp_path / f"{index}.txt"
+        path.write_bytes(str(index).encode())
+        paths.append(str(path))
+    paths.insert(1, str(tmp_path / "missing.txt"))
+
+    results = list(hash_files(paths, processes=2))
+
+    assert [path for path, _ in results] == paths
+    assert isinstance(results[1][1], OSError)
+    assert results[0][1] == hashlib.md5(b"0").hexdigest()
+    assert results[3][1] == hashlib.md5(b"2").hexdigest()
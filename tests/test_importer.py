@@ -1,9 +1,17 @@
 from __future__ import annotations
 
+import json
+import os
+from dataclasses import replace
+
 import pytest
 
 from app import create_app
+from app.blueprints.importer import _process_record, _process_records, _stream_ndjson_results
 from app.config import CeleryConfig, Config
+from app.dedup import LocalDedupCache, RedisDedupCache
+from app.result_store import FileResultStore, _ExpiringResultStore, iter_stored_result
+from app.tasks.importer import ProgressThrottle
 
 
 class TestConfig(Config):
@@ -127,3 +135,328 @@ def test_progress_task_status(eager_client):
     processed = status_data["result"]["processed"]
     assert processed[0]["normalized_payload"] == "gpu job"
     assert processed[1]["normalized_payload"] == "cpu job"
+
+
+def test_ingest_records_enqueued_in_chunks(eager_client):
+    payload = {
+        "source": "unit-test",
+        "enqueue": True,
+        "chunk_size": 2,
+        "records": [{"id": index, "payload": f" Item {index} "} for index in range(5)],
+    }
+
+    response = eager_client.post("/api/importer/ingest", json=payload)
+
+    assert response.status_code == 202
+    data = response.get_json()
+    assert data["status"] == "queued"
+    assert data["group_id"]
+    assert data["queued_tasks"] == 3
+    assert data["queued_records"] == 5
+    assert "tasks" not in data
+    assert [item["normalized_payload"] for item in data["results"]] == [f"item {index}" for index in range(5)]
+
+
+def test_group_status_restores_chunked_ingest(eager_client):
+    payload = {
+        "enqueue": True,
+        "chunk_size": 2,
+        "records": [{"id": index, "payload": f" Item {index} "} for index in range(3)],
+    }
+
+    data = eager_client.post("/api/importer/ingest", json=payload).get_json()
+    assert data["status_url"] == f"/api/importer/status/group/{data['group_id']}"
+
+    response = eager_client.get(data["status_url"])
+
+    assert response.status_code == 200
+    status = response.get_json()
+    assert status["group_id"] == data["group_id"]
+    assert status["state"] == "SUCCESS"
+    assert (status["total_tasks"], status["completed_tasks"], status["failed_tasks"]) == (2, 2, 0)
+    assert [item["id"] for item in status["results"]] == ["0", "1", "2"]
+
+
+def test_group_status_unknown_group(eager_client):
+    response = eager_client.get("/api/importer/status/group/missing")
+
+    assert response.status_code == 404
+    assert response.get_json()["status"] == "error"
+
+
+def test_ingest_rejects_invalid_chunk_size(client):
+    payload = {"enqueue": True, "chunk_size": -1, "records": [{"id": 1, "payload": "x"}]}
+
+    response = client.post("/api/importer/ingest", json=payload)
+
+    assert response.status_code == 400
+    assert "chunk_size" in response.get_json()["message"]
+
+
+def test_ingest_ndjson_streams_results(client):
+    body = "\n".join(
+        [
+            json.dumps({"id": 1, "payload": "  Hello  "}),
+            "",
+            json.dumps({"id": 2}),
+            "not json",
+            json.dumps({"id": 3, "payload": "World"}),
+        ]
+    )
+
+    response = client.post(
+        "/api/importer/ingest?source=stream", data=body, content_type="application/x-ndjson"
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0]["normalized_payload"] == "hello"
+    assert lines[1] == {
+        "status": "error",
+        "index": 1,
+        "message": "Record at index 1 is missing required field 'payload'",
+    }
+    assert lines[2]["status"] == "error" and lines[2]["index"] == 2
+    assert lines[3]["id"] == "3"
+    assert lines[4] == {"status": "partial", "source": "stream", "imported": 2, "failed": 2}
+
+
+def test_ingest_ndjson_requires_records(client):
+    response = client.post("/api/importer/ingest", data="\n", content_type="application/x-ndjson")
+
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == [{"status": "error", "source": "unspecified", "message": "`records` must be a non-empty list"}]
+
+
+def test_process_records_matches_single_record_path():
+    records = [{"id": str(index), "payload": f"  Record {index} "} for index in range(23)]
+
+    expected = [_process_record(record) for record in records]
+
+    assert _process_records(records) == expected
+    assert _process_records(records, parallel_threshold=5, processes=2) == expected
+
+
+def test_progress_throttle_by_count_and_time():
+    now = [0.0]
+    throttle = ProgressThrottle(every_records=10, interval=5.0, clock=lambda: now[0])
+
+    assert not throttle.due(5)
+    assert throttle.due(10)
+    assert not throttle.due(19)
+    now[0] = 6.0
+    assert throttle.due(20)
+
+
+def test_task_status_stream_pushes_final_state(eager_client):
+    enqueue_response = eager_client.post(
+        "/api/importer/progress", json={"records": [{"id": 1, "payload": " Stream "}]}
+    )
+    task_id = enqueue_response.get_json()["task_id"]
+
+    response = eager_client.get(f"/api/importer/status/{task_id}/stream")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = response.get_data(as_text=True).strip().split("\n\n")
+    assert len(events) == 1
+    event_line, data_line = events[0].split("\n")
+    assert event_line == "event: state"
+    data = json.loads(data_line[len("data: ") :])
+    assert data["state"] == "SUCCESS"
+    assert data["result"]["processed"][0]["normalized_payload"] == "stream"
+
+
+def test_task_status_stream_bounds_interval_and_timeout(client, monkeypatch):
+    calls = []
+
+    def fake_events(celery_app, task_id, interval, timeout):
+        calls.append((interval, timeout))
+        return iter([])
+
+    monkeypatch.setattr("app.blueprints.importer._stream_task_events", fake_events)
+
+    client.get("/api/importer/status/abc/stream?interval=0.01&timeout=86400")
+    client.get("/api/importer/status/abc/stream?interval=5&timeout=30")
+    client.get("/api/importer/status/abc/stream")
+
+    assert calls == [(1.0, 300.0), (5.0, 30.0), (1.0, 300.0)]
+
+
+def test_file_result_store_round_trip(tmp_path):
+    store = FileResultStore(str(tmp_path))
+
+    result_ref = store.save("task-1", {"processed": [{"id": "1"}], "total": 1})
+
+    assert result_ref["store"] == "file" and result_ref["key"] == "task-1"
+    assert json.loads(b"".join(iter_stored_result(store.open("task-1")))) == {"processed": [{"id": "1"}], "total": 1}
+    with pytest.raises(ValueError):
+        store.save("../escape", {})
+
+
+def test_file_result_store_purges_expired_results_on_save(tmp_path):
+    keeper = FileResultStore(str(tmp_path), ttl=0)
+    keeper.save("old", {})
+    os.utime(tmp_path / "old.json.gz", (0, 0))
+    for name in (".crashed.part", "notes.txt"):
+        (tmp_path / name).write_text("x")
+        os.utime(tmp_path / name, (0, 0))
+    assert keeper.purge_expired() == 0
+
+    store = FileResultStore(str(tmp_path), ttl=60, purge_interval=3600)
+    store.save("new", {})
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["new.json.gz", "notes.txt"]
+
+    keeper.save("stale", {})
+    os.utime(tmp_path / "stale.json.gz", (0, 0))
+    store.save("newer", {})
+    assert (tmp_path / "stale.json.gz").exists()
+
+
+def test_result_store_base_requires_purge():
+    with pytest.raises(TypeError):
+        _ExpiringResultStore()
+
+
+def test_large_progress_result_is_offloaded(tmp_path):
+    class StoreConfig(EagerCeleryConfig):
+        CELERY_CONFIG = replace(
+            EagerCeleryConfig.CELERY_CONFIG,
+            result_store="file",
+            result_store_dir=str(tmp_path),
+            result_store_threshold=2,
+        )
+
+    client = create_app(StoreConfig()).test_client()
+    payload = {"records": [{"id": 1, "payload": " A "}, {"id": 2, "payload": " B "}]}
+    task_id = client.post("/api/importer/progress", json=payload).get_json()["task_id"]
+
+    status_data = client.get(f"/api/importer/status/{task_id}").get_json()
+    assert status_data["result"] == {
+        "total": 2,
+        "result_ref": {"store": "file", "key": task_id, "size": status_data["result"]["result_ref"]["size"]},
+    }
+    assert status_data["result_url"].endswith("result=1")
+
+    full_response = client.get(status_data["result_url"])
+    assert full_response.status_code == 200
+    full_data = json.loads(full_response.get_data())
+    assert full_data["state"] == "SUCCESS"
+    assert [item["normalized_payload"] for item in full_data["result"]["processed"]] == ["a", "b"]
+
+    FileResultStore(str(tmp_path)).delete(task_id)
+    assert client.get(status_data["result_url"]).status_code == 410
+
+
+class DedupConfig(TestConfig):
+    IMPORTER_DEDUP_ENABLED = True
+
+
+def test_ingest_dedup_reports_cached_and_collapses_ids():
+    client = create_app(DedupConfig()).test_client()
+    first = client.post(
+        "/api/importer/ingest",
+        json={"records": [{"id": 1, "payload": " Old "}, {"id": 2, "payload": "Two"}, {"id": 1, "payload": " New "}]},
+    ).get_json()
+
+    assert first["collapsed"] == 1
+    assert first["cached"] == 0
+    assert [result["normalized_payload"] for result in first["results"]] == ["new", "two"]
+
+    second = client.post(
+        "/api/importer/ingest",
+        json={"records": [{"id": 2, "payload": "Two"}, {"id": 3, "payload": "Three"}]},
+    ).get_json()
+
+    assert second["cached"] == 1
+    assert second["results"][0] == {**first["results"][1], "cached": True}
+    assert "cached" not in second["results"][1]
+
+
+def test_ingest_ndjson_dedup_marks_cached_and_collapsed_lines():
+    client = create_app(DedupConfig()).test_client()
+    body = "\n".join(json.dumps(record) for record in [{"id": 1, "payload": " A "}, {"id": 1, "payload": "B"}])
+
+    def post():
+        response = client.post("/api/importer/ingest", data=body, content_type="application/x-ndjson")
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    first = post()
+    assert first[0] == {"id": "1", "normalized_payload": "a", "original_length": 3, "trimmed_length": 1}
+    assert first[1] == {"status": "collapsed", "index": 1, "id": "1"}
+    assert first[2]["imported"] == 1 and first[2]["collapsed"] == 1 and first[2]["cached"] == 0
+
+    second = post()
+    assert second[0] == {**first[0], "cached": True}
+    assert second[2]["cached"] == 1
+
+
+def test_ndjson_dedup_blocks_keep_input_order():
+    lines = [json.dumps({"id": index, "payload": f"P{index}"}).encode() for index in range(3)]
+    lines.insert(1, b"not json")
+
+    output = [
+        json.loads(line)
+        for line in _stream_ndjson_results(iter(lines), "unit", LocalDedupCache(), block_size=2)
+    ]
+
+    assert [item.get("id", item.get("status")) for item in output] == ["0", "error", "1", "2", "partial"]
+
+def test_local_dedup_cache_ttl_and_lru(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("app.dedup.time.monotonic", lambda: now[0])
+    cache = LocalDedupCache(max_entries=2, ttl=10)
+
+    cache.set_many([("a", {"id": "a"}), ("b", {"id": "b"})])
+    assert cache.get_many(["a"]) == {"a": {"id": "a"}}
+    cache.set_many([("c", {"id": "c"})])
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+
+    now[0] = 11.0
+    assert cache.get_many(["a", "c"]) == {}
+
+
+def test_redis_dedup_cache_shares_entries_and_survives_errors():
+    class FakePipeline:
+        def __init__(self, store):
+            self.store = store
+            self.ops = []
+
+        def set(self, key, value, ex=None):
+            self.ops.append((key, value))
+
+        def execute(self):
+            self.store.update(self.ops)
+
+    class FakeRedis:
+        def __init__(self):
+            self.store = {}
+
+        def mget(self, keys):
+            return [self.store.get(key) for key in keys]
+
+        def pipeline(self, transaction=True):
+            return FakePipeline(self.store)
+
+    client = FakeRedis()
+    writer = RedisDedupCache(client, LocalDedupCache())
+    reader = RedisDedupCache(client, LocalDedupCache())
+
+    writer.set_many([("k", {"id": "1"})])
+    assert reader.get_many(["k", "missing"]) == {"k": {"id": "1"}}
+
+    client.mget = lambda keys: (_ for _ in ()).throw(ConnectionError("down"))
+    assert RedisDedupCache(client, LocalDedupCache()).get_many(["k"]) == {}
+
+
+def test_ingest_skips_dedup_keys_when_cache_disabled(client, monkeypatch):
+    def fail(record):
+        raise AssertionError("dedup key computed with dedup disabled")
+
+    monkeypatch.setattr("app.dedup.dedup_key", fail)
+
+    response = client.post("/api/importer/ingest", json={"records": [{"id": 1, "payload": " A "}]})
+
+    assert response.status_code == 200
+    assert "cached" not in response.get_json()
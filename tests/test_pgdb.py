@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import collections
+from collections import namedtuple
+
+import psycopg2.errors
+import psycopg2.extensions
+import pytest
+
+from libs.pgdb_class import (
+    _server_placeholders,
+    copy_stream,
+    dict_rows,
+    namedtuple_rows,
+    pgdb,
+    record_rows,
+    query_stats,
+    sql_fingerprint,
+    tuple_rows,
+)
+
+Column = namedtuple("Column", ["name"])
+
+
+class FakeCursor:
+    rowcount = -1
+
+    def __init__(self, rows, columns, name=None):
+        self.name = name
+        self.source = rows
+        self.rows = list(rows)
+        self.description = [Column(column) for column in columns]
+        self.closed = False
+        self.fetch_sizes = []
+
+    def execute(self, sql, pars=None):
+        self.sql = sql
+        self.pars = pars
+        self.rows = list(self.source)
+
+    def fetchmany(self, size):
+        self.fetch_sizes.append(size)
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def fetchall(self):
+        batch, self.rows = self.rows, []
+        return batch
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    closed = 0
+
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = columns
+        self.cursors = []
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self, name=None, withhold=False):
+        cursor = FakeCursor(self.rows, self.columns, name=name)
+        self.cursors.append(cursor)
+        return cursor
+
+
+def _make_db(rows, columns):
+    db = pgdb.__new__(pgdb)
+    db.pool = None
+    db.row_factory = tuple_rows
+    db.con = FakeConnection(rows, columns)
+    db.cur = db.con.cursor()
+    return db
+
+
+def test_iter_dict_streams_through_named_cursor():
+    db = _make_db([(1, "a"), (2, "b"), (3, "c")], ["id", "md5"])
+
+    rows = list(db.iter_dict("select id, md5 from books", itersize=2))
+
+    assert rows == [{"id": 1, "md5": "a"}, {"id": 2, "md5": "b"}, {"id": 3, "md5": "c"}]
+    named = db.con.cursors[-1]
+    assert named.name.startswith("pgdb_iter_")
+    assert named.fetch_sizes == [2, 2, 2]
+    assert named.closed
+
+
+def test_row_factories_per_call_and_per_instance():
+    db = _make_db([(1, "a"), (2, "b")], ["id", "class"])
+
+    assert db.fetchall("select id, class from t") == [(1, "a"), (2, "b")]
+    assert db.fetchall_dict("select id, class from t") == [{"id": 1, "class": "a"}, {"id": 2, "class": "b"}]
+
+    first = db.fetchone("select id, class from t", row_factory=namedtuple_rows)
+    assert first.id == 1 and first[1] == "a"
+
+    db.row_factory = record_rows
+    records = db.fetchall("select id, class from t")
+    assert records[1].id == 2
+    assert records[1]._asdict() == {"id": 2, "_1": "b"}
+    assert type(records[0]) is type(records[1])
+    assert not hasattr(records[0], "__dict__")
+
+
+def test_copy_stream_encodes_rows_lazily():
+    produced = []
+
+    def rows():
+        for row in [(1, "a\tb", None), (2, "back\\slash", True), (3, {"k": 1}, b"\x01")]:
+            produced.append(row)
+            yield row
+
+    stream = copy_stream(rows())
+    first = stream.read(4)
+    assert first == "1\ta\\"
+    assert len(produced) == 1
+
+    rest = stream.read()
+    assert first + rest == '1\ta\\tb\t\\N\n2\tback\\\\slash\tt\n3\t{"k": 1}\t\\\\x01\n'
+    assert stream.read(10) == ""
+
+
+def test_server_placeholders():
+    assert _server_placeholders("select * from books where md5=%s and reload=%s", ["x", 0]) == (
+        "select * from books where md5=$1 and reload=$2"
+    )
+    assert _server_placeholders("select '100%%' || %s", ["x"]) == "select '100%' || $1"
+    assert _server_placeholders("select %(md5)s", {"md5": "x"}) is None
+    assert _server_placeholders("vacuum books", []) is None
+
+
+def _make_preparing_db(monkeypatch, rows, columns):
+    monkeypatch.setattr(pgdb, "PREPARE_STATEMENTS", True)
+    db = _make_db(rows, columns)
+    db.con.statements = collections.OrderedDict()
+    db.con.statement_seq = 0
+    db.con.stale_statements = []
+    return db
+
+
+def test_repeated_query_is_prepared_once(monkeypatch):
+    db = _make_preparing_db(monkeypatch, [("md5",)], ["md5"])
+    executed = []
+    monkeypatch.setattr(db.cur, "execute", lambda sql, pars=None: executed.append((sql, pars)))
+    monkeypatch.setattr(db.cur, "fetchone", lambda: ("md5",))
+
+    for _ in range(3):
+        db.fetchone("select md5 from books where id=%s", [7])
+
+    assert executed == [
+        ("select md5 from books where id=%s", [7]),
+        ("savepoint pgdb_prepare; prepare pgdb_ps_1 as select md5 from books where id=$1; "
+         "release savepoint pgdb_prepare", None),
+        ("execute pgdb_ps_1 (%s)", [7]),
+        ("execute pgdb_ps_1 (%s)", [7]),
+    ]
+
+
+def test_query_stats_aggregate_by_fingerprint(monkeypatch, caplog):
+    db = _make_db([(1,), (2,)], ["id"])
+    monkeypatch.setattr(db, "STATS", query_stats())
+    monkeypatch.setattr(db, "SLOW_QUERY_MS", 0)
+
+    db.fetchall("select id from books where md5=%s", ["abc"])
+    db.fetchall("select id from  books where md5='def'")
+
+    assert sql_fingerprint("select id from books where id = 5") == "select id from books where id = ?"
+    [entry] = db.STATS.snapshot()
+    assert entry["sql"] == "select id from books where md5=?"
+    assert entry["calls"] == 2
+    assert "pars=['str[3]']" in caplog.text
+    assert "abc" not in caplog.text
+
+
+def _schema_changing_execute(monkeypatch, db, in_transaction):
+    executed = []
+    schema_changed = [False]
+    original = db.cur.execute
+
+    def execute(sql, pars=None):
+        executed.append(sql)
+        if schema_changed[0] and sql.startswith("execute "):
+            schema_changed[0] = False
+            if in_transaction:
+                db.con.status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+            raise psycopg2.errors.FeatureNotSupported("cached plan must not change result type")
+        original(sql, pars)
+
+    monkeypatch.setattr(db.cur, "execute", execute)
+    for _ in range(2):
+        db.fetchall("select * from books where id=%s", [1])
+    schema_changed[0] = True
+    return executed
+
+
+def test_prepared_statement_recovers_after_schema_change(monkeypatch):
+    db = _make_preparing_db(monkeypatch, [(1,)], ["id"])
+    executed = _schema_changing_execute(monkeypatch, db, in_transaction=False)
+
+    assert db.fetchall("select * from books where id=%s", [1]) == [(1,)]
+    assert db.con.rollbacks == 1
+    assert executed[-3:] == ["execute pgdb_ps_1 (%s)", "deallocate pgdb_ps_1", "select * from books where id=%s"]
+    assert "select * from books where id=%s" not in db.con.statements
+
+
+def test_prepared_statement_error_inside_transaction_propagates_once(monkeypatch):
+    db = _make_preparing_db(monkeypatch, [(1,)], ["id"])
+    executed = _schema_changing_execute(monkeypatch, db, in_transaction=True)
+    db.con.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+    with pytest.raises(psycopg2.errors.FeatureNotSupported):
+        db.fetchall("select * from books where id=%s", [1])
+    assert db.con.stale_statements == ["pgdb_ps_1"]
+
+    db.con.rollback()
+    assert db.fetchall("select * from books where id=%s", [1]) == [(1,)]
+    assert executed[-2:] == ["deallocate pgdb_ps_1", "select * from books where id=%s"]
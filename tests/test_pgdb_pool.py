@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import psycopg2.extensions
+import pytest
+
+from libs.pgdb_class import PoolTimeout, pgdb, pgdb_pool
+
+
+class FakeCursor:
+    closed = False
+
+    def execute(self, sql, pars=None):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.rollbacks = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor()
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool(pgdb_pool):
+    def _connect(self):
+        return FakeConnection()
+
+
+def test_pool_reuses_returned_connection():
+    pool = FakePool(minconn=0, maxconn=2, timeout=0.01)
+    con = pool.getconn()
+    pool.putconn(con)
+
+    assert pool.getconn() is con
+
+
+def test_pool_times_out_when_exhausted():
+    pool = FakePool(minconn=0, maxconn=1, timeout=0.01)
+    pool.getconn()
+
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+
+
+def test_pool_rolls_back_open_transaction_and_replaces_dead_connection():
+    pool = FakePool(minconn=0, maxconn=1, timeout=0.01)
+    con = pool.getconn()
+    con.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(con)
+    assert con.rollbacks == 1
+
+    con.closed = 1
+    replacement = pool.getconn()
+    assert replacement is not con
+    assert not replacement.closed
+
+
+def test_pgdb_borrows_from_configured_pool(monkeypatch):
+    pool = FakePool(minconn=0, maxconn=1, timeout=0.01)
+    monkeypatch.setattr(pgdb, "POOL", pool)
+
+    with pgdb() as db:
+        con = db.con
+    with pgdb() as db:
+        assert db.con is con
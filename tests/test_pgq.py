@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import pytest
+
+from libs.pgq_class import pgq_class, pgq_consumer
+
+
+class FakeDb:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.executed = []
+        self.commits = 0
+
+    def fetchall(self, sql, pars=[]):
+        self.executed.append((sql, pars))
+        return self.rows
+
+    def execute(self, sql, pars=[]):
+        self.executed.append((sql, pars))
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_get_and_complete_tasks_in_one_statement_each():
+    db = FakeDb(rows=[(5,), (3,)])
+    queue = pgq_class(db, "tbc.import_queue", batch_size=10)
+
+    ids = queue.get_tasks()
+    queue.complete_tasks(ids)
+
+    assert ids == [3, 5]
+    claim_sql, claim_pars = db.executed[0]
+    assert "limit %s" in claim_sql and claim_pars == [10]
+    complete_sql, complete_pars = db.executed[1]
+    assert "= any(%s)" in complete_sql and complete_pars == [[3, 5]]
+    assert db.commits == 2
+
+
+def test_batch_size_adapts_to_processing_time():
+    queue = pgq_class(FakeDb(), "q", batch_size=100, max_batch_size=150, target_batch_seconds=1.0)
+
+    assert queue.adapt_batch_size(100, 0.1) == 150
+    assert queue.adapt_batch_size(150, 6.0) == 75
+    assert queue.adapt_batch_size(75, 0.75) == 100
+
+
+def test_wait_for_task_rechecks_when_notify_arrived_during_claim(monkeypatch):
+    class FakeConnection:
+        notifies: list = []
+
+    db = FakeDb()
+    db.con = FakeConnection()
+    queue = pgq_class(db, "tbc.import_queue")
+    claims = iter([False, 42])
+
+    def get_task():
+        task = next(claims)
+        if not task:
+            db.con.notifies.append("notify")
+        return task
+
+    monkeypatch.setattr(queue, "get_task", get_task)
+
+    assert queue.wait_for_task(timeout=0) == 42
+    assert queue.channel == "pgq_tbc_import_queue"
+    assert db.executed[0][0] == 'listen "pgq_tbc_import_queue"'
+
+
+def test_reclaim_expired_requeues_processing_rows_with_old_lease():
+    db = FakeDb(rows=[(7,)])
+    queue = pgq_class(db, "q", lease_column_name="pgq_lease", lease_seconds=60)
+
+    assert queue.reclaim_expired() == [7]
+    sql, _ = db.executed[0]
+    assert "pgq_status = 0, pgq_lease = null" in sql
+    assert "pgq_lease < now()" in sql
+    assert "pgq_lease = now() + 60.0 * interval '1 second'" in queue._claim_set()
+
+
+def test_consumer_runs_handler_and_completes_tasks():
+    handled = []
+    batches = [[(1,), (2,)], [(3,)]]
+
+    class QueueDb(FakeDb):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def fetchall(self, sql, pars=[]):
+            self.executed.append((sql, pars))
+            if "for update skip locked" in sql and batches:
+                return batches.pop(0)
+            return []
+
+    db = QueueDb()
+
+    def handler(task_id):
+        handled.append(task_id)
+        if task_id == 2:
+            raise RuntimeError("broken file")
+        if task_id == 3:
+            consumer.stop()
+
+    consumer = pgq_consumer(lambda: db, "q", handler, workers=1, use_notify=False, wait_timeout=0.01,
+                            lease_column_name="pgq_lease")
+    consumer.run()
+
+    assert handled == [1, 2, 3]
+    completed = [pars[0] for sql, pars in db.executed if "set pgq_status=2" in sql]
+    assert completed == [[1], [3]]
+    failed = [pars[0] for sql, pars in db.executed if sql.startswith("update q set pgq_status = 3")]
+    assert failed == [[2]]
+
+
+def test_consumer_survives_database_errors_and_reclaims_from_supervisor():
+    handled = []
+    claims = [RuntimeError("connection lost"), [(4,)]]
+    connections = []
+
+    class FlakyDb(FakeDb):
+        def __enter__(self):
+            connections.append(self)
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def fetchall(self, sql, pars=[]):
+            self.executed.append((sql, pars))
+            if "for update skip locked" in sql and claims:
+                claim = claims.pop(0)
+                if isinstance(claim, Exception):
+                    raise claim
+                return claim
+            return []
+
+    def handler(task_id):
+        handled.append(task_id)
+        consumer.stop()
+
+    consumer = pgq_consumer(lambda: FlakyDb(), "q", handler, workers=1, use_notify=False, wait_timeout=0.01,
+                            error_backoff=0.01, lease_column_name="pgq_lease")
+    consumer.run()
+
+    assert handled == [4]
+    reclaimers = [db for db in connections if any("pgq_lease < now()" in sql for sql, _ in db.executed)]
+    assert reclaimers and not any("skip locked" in sql for sql, _ in reclaimers[0].executed)
+    workers = [db for db in connections if any("skip locked" in sql for sql, _ in db.executed)]
+    # после ошибки воркер открыл новое соединение
+    assert len(workers) == 2
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_consumer_restarts_dead_worker():
+    handled = []
+    batches = [[(1,)], [(2,)]]
+
+    class QueueDb(FakeDb):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def fetchall(self, sql, pars=[]):
+            self.executed.append((sql, pars))
+            if "for update skip locked" in sql and batches:
+                return batches.pop(0)
+            return []
+
+    def handler(task_id):
+        handled.append(task_id)
+        if task_id == 1:
+            raise SystemExit
+        consumer.stop()
+
+    consumer = pgq_consumer(QueueDb, "q", handler, workers=1, use_notify=False, wait_timeout=0.01,
+                            lease_column_name="pgq_lease")
+    consumer.run()
+
+    assert handled == [1, 2]
+
+def test_consumer_requires_lease_column():
+    with pytest.raises(ValueError, match="lease_column_name"):
+        pgq_consumer(lambda: None, "q", print)
+
+
+def test_fail_tasks_requeues_until_attempts_are_exhausted():
+    db = FakeDb(rows=[(4, 0), (9, 3)])
+    queue = pgq_class(db, "q", lease_column_name="pgq_lease", attempts_column_name="pgq_attempts", max_attempts=3)
+
+    assert queue.fail_tasks([4, 9]) == [9]
+    sql, pars = db.executed[0]
+    assert "case when coalesce(pgq_attempts, 0) >= 3 then 3 else 0 end, pgq_lease = null" in sql
+    assert pars == [[4, 9]]
+    assert "pgq_attempts = coalesce(pgq_attempts, 0) + 1" in queue._claim_set()
+
+    queue.reclaim_expired()
+    assert "set pgq_status = case when coalesce(pgq_attempts, 0) >= 3" in db.executed[1][0]
+
+    queue.release_tasks([5])
+    assert "pgq_attempts = greatest(coalesce(pgq_attempts, 0) - 1, 0)" in db.executed[2][0]
+
+
+def test_ensure_indexes_creates_partial_index_for_queue_status():
+    db = FakeDb()
+    db.con = None
+    queue = pgq_class(db, "tbc.import_queue", filter=" 1=1 ", lease_column_name="pgq_lease")
+
+    queue.ensure_indexes()
+
+    assert [sql for sql, _ in db.executed] == [
+        "create index if not exists import_queue_pgq_status_inqueue_idx on tbc.import_queue (id) where pgq_status = 0",
+        "create index if not exists import_queue_pgq_status_lease_idx on tbc.import_queue (pgq_lease) "
+        "where pgq_status = 1",
+        "create index if not exists import_queue_pgq_status_failed_idx on tbc.import_queue (id) where pgq_status = 3",
+    ]
+
+
+def test_stats_counts_each_status_by_its_index_predicate():
+    counts = {"pgq_status = 0 and (kind = 1)": 5, "pgq_status = 1": 2, "pgq_status = 3": 1}
+
+    class StatsDb(FakeDb):
+        def fetchone(self, sql, pars=[]):
+            self.executed.append((sql, pars))
+            if "pg_class" in sql:
+                return (100,)
+            if "pgq_claimed >=" in sql:
+                return (30,)
+            if sql.startswith("select count(*) from q where "):
+                return (counts[sql.split(" where ", 1)[1]],)
+            return (12, 4.5)
+
+    db = StatsDb()
+    queue = pgq_class(db, "q", filter="kind = 1", lease_column_name="pgq_lease", created_column_name="created",
+                      claimed_column_name="pgq_claimed")
+
+    stats = queue.stats(rate_window=60)
+
+    assert stats["depth"] == {"inqueue": 5, "processing": 2, "completed": 92, "failed": 1}
+    assert " in (" not in "".join(sql for sql, _ in db.executed)
+    assert stats["oldest_inqueue_id"] == 12
+    assert stats["claim_rate"] == 0.5
+    assert "pgq_claimed = now()" in queue._claim_set()
+
+    without_lease = pgq_class(db, "q", filter="kind = 1").stats()
+    assert without_lease["depth"]["processing"] is None
+    assert without_lease["depth"]["completed"] == 94
+    assert without_lease["claim_rate"] is None
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from libs.placement_class import file_placer
+
+
+def _write(path, data: bytes):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_move_and_linked_copy_on_same_filesystem(tmp_path):
+    placer = file_placer(fsync=True, link_copies=True)
+    src = _write(tmp_path / "book.pdf", b"pdf")
+    target = str(tmp_path / "data" / "pool1" / "1000" / "1001" / "book.pdf")
+
+    assert placer.place(src, target, "copy") == target
+    assert os.path.samefile(src, target)
+
+    moved = str(tmp_path / "data" / "pool1" / "1000" / "1002" / "book.pdf")
+    placer.place(src, moved, "move")
+    assert not os.path.exists(src)
+    assert open(moved, "rb").read() == b"pdf"
+
+
+def test_copy_data_without_links_by_default(tmp_path):
+    placer = file_placer()
+    src = _write(tmp_path / "scan.djvu", os.urandom(300_000))
+    target = str(tmp_path / "out" / "scan.djvu")
+
+    placer.place(src, target, "copy")
+
+    assert not os.path.samefile(src, target)
+    assert open(src, "rb").read() == open(target, "rb").read()
+    assert not os.path.exists(target + ".part")
+
+
+def test_place_many_keeps_order_and_reports_errors(tmp_path):
+    placer = file_placer(max_workers=4)
+    jobs = []
+    for index in range(5):
+        src = _write(tmp_path / f"{index}.txt", str(index).encode())
+        jobs.append((src, str(tmp_path / "dst" / str(index) / "book.txt"), "move"))
+    jobs.insert(2, (str(tmp_path / "missing.txt"), str(tmp_path / "dst" / "x" / "book.txt"), "move"))
+
+    results = placer.place_many(jobs)
+
+    assert isinstance(results[2], FileNotFoundError)
+    assert [result for index, result in enumerate(results) if index != 2] == [
+        job[1] for index, job in enumerate(jobs) if index != 2
+    ]
+
+
+def test_job_can_forbid_hardlink(tmp_path):
+    placer = file_placer(link_copies=True)
+    src = _write(tmp_path / "cover.jpg", b"cover")
+    target = str(tmp_path / "out" / "cover_small.jpg")
+
+    [result] = placer.place_many([(src, target, "copy", False)])
+
+    assert result == target
+    assert not os.path.samefile(src, target)
+    with open(src, "wb") as rewritten:
+        rewritten.write(b"other")
+    assert open(target, "rb").read() == b"cover"
+
+
+def test_ensure_dir_caches_only_parent_directories(tmp_path):
+    placer = file_placer()
+    parent = str(tmp_path / "data" / "pool1" / "1000")
+
+    for book_id in range(1000, 1005):
+        placer.ensure_dir(os.path.join(parent, str(book_id)))
+    placer.ensure_dir(os.path.join(parent, "1000"))
+
+    assert placer._dirs == {parent}
+    assert sorted(os.listdir(parent)) == [str(book_id) for book_id in range(1000, 1005)]
+
+
+def test_failed_copy_removes_partial_file(tmp_path, monkeypatch):
+    placer = file_placer()
+    src = _write(tmp_path / "big.pdf", b"x" * 1000)
+    target = str(tmp_path / "out" / "big.pdf")
+
+    def broken_copy(src_fd, dst_fd, size):
+        os.write(dst_fd, b"x" * 10)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(placer, "_copy_fd", broken_copy)
+
+    with pytest.raises(OSError, match="disk full"):
+        placer.place(src, target, "copy")
+    assert os.listdir(tmp_path / "out") == []
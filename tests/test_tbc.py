@@ -0,0 +1,426 @@
+from __future__ import annotations
+
+import importlib
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import libs.hash_class
+import libs.pgdb_class
+import libs.placement_class
+
+
+class FakeLangDetect:
+    calls: list = []
+
+    def detect(self, text):
+        FakeLangDetect.calls.append(text)
+        return "russian" if "а" in text else "english"
+
+
+def _stub(name, **attrs):
+    module = types.ModuleType(name)
+    for attr, value in attrs.items():
+        setattr(module, attr, value)
+    return module
+
+
+@pytest.fixture()
+def tbc(monkeypatch, tmp_path):
+    """libs.tbc_class imported against stubbed tbclibs/PIL, with tbclibs.* helpers aliased to libs.*."""
+
+    stubs = {
+        "PIL": _stub("PIL", Image=None),
+        "tbclibs": _stub("tbclibs"),
+        "tbclibs.langdetect_class": _stub("tbclibs.langdetect_class", LangDetect=FakeLangDetect),
+        "tbclibs.book_utils": _stub(
+            "tbclibs.book_utils",
+            extract_meta_from_book=None,
+            TextLayerExtractorClass=None,
+            extract_images_class=None,
+            TextlayerMetaExtractor=None,
+        ),
+        "tbclibs.websearch_class": _stub("tbclibs.websearch_class", websearch_class=None),
+        "tbclibs.pgdb_class": libs.pgdb_class,
+        "tbclibs.placement_class": libs.placement_class,
+        "tbclibs.hash_class": libs.hash_class,
+    }
+    for name, module in stubs.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    sys.modules.pop("libs.tbc_class", None)
+    FakeLangDetect.calls = []
+
+    module = importlib.import_module("libs.tbc_class")
+    module.TBC.storage_base = str(tmp_path / "data")
+    yield module
+    sys.modules.pop("libs.tbc_class", None)
+
+
+class FakeDb:
+    """Just enough of pgdb for TBC: books keyed by id, a sequence and a call log."""
+
+    instances = 0
+
+    def __init__(self):
+        FakeDb.instances += 1
+        self.books = {}
+        self.seq = 1000
+        self.log = []
+        self.locations = {1000: "loc1"}
+        self.active_pool = "pool1"
+        self.fail_insert_many = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def fetchall(self, sql, pars=[]):
+        self.log.append(sql)
+        if "generate_series" in sql:
+            rows = [(self.seq + index,) for index in range(pars[0])]
+            self.seq += pars[0]
+            return rows
+        if "from book_locator" in sql:
+            return list(self.locations.items())
+        if "advisory" in sql:
+            return []
+        raise AssertionError(sql)
+
+    def fetchone(self, sql, pars=[]):
+        self.log.append(sql)
+        if "book_locator where th=%s" in sql:
+            return (self.locations[pars[0]],) if pars[0] in self.locations else None
+        raise AssertionError(sql)
+
+    def fetchone_dict(self, sql, pars=[]):
+        self.log.append(sql)
+        if "storage_pools" in sql:
+            return {"name": self.active_pool} if self.active_pool else False
+        if "md5=%s" in sql:
+            reload_only = "reload=0" in sql
+            matches = (book for book in self.books.values() if book["md5"] == pars[0])
+            return next((book for book in matches if not (reload_only and book["reload"])), False)
+        if "id=%s" in sql:
+            return self.books.get(pars[0])
+        raise AssertionError(sql)
+
+    def fetchall_dict(self, sql, pars=[]):
+        self.log.append(sql)
+        if "md5 = any" in sql:
+            return [book for book in self.books.values() if book["md5"] in pars[0]]
+        if "id = any" in sql:
+            return [self.books[book_id] for book_id in pars[0] if book_id in self.books]
+        raise AssertionError(sql)
+
+    def insert_many(self, table, columns, rows):
+        self.log.append(("insert_many", len(rows)))
+        if self.fail_insert_many:
+            raise RuntimeError("insert_many failed")
+        for row in rows:
+            self._add(dict(zip(columns, row)))
+
+    def _add(self, book):
+        book.setdefault("reload", 0)
+        self.books[book["id"]] = book
+
+    def execute(self, sql, pars=[]):
+        self.log.append(sql)
+        if sql.startswith("insert into books"):
+            self._add(dict(zip(sql.split("(")[1].split(")")[0].split(","), pars)))
+        elif sql.startswith("update books set reload=1 where id = any"):
+            for book_id in pars[0]:
+                self.books[book_id]["reload"] = 1
+        elif sql.startswith("update books set"):
+            columns = [part.split("=")[0] for part in sql[len("update books set ") :].split(" where")[0].split(",")]
+            book_id = pars[-1] if sql.endswith("id=%s") else int(sql.rsplit("=", 1)[1])
+            self.books[book_id].update(zip(columns, pars))
+        elif sql.startswith("delete from books where id = any"):
+            for book_id in pars[0]:
+                self.books.pop(book_id, None)
+
+    def commit(self):
+        self.log.append("commit")
+
+    def rollback(self):
+        self.log.append("rollback")
+
+
+def test_id_allocator_reserves_blocks_and_reuses_them(tbc):
+    db = FakeDb()
+    allocator = tbc.tbc_id_allocator(block_size=5)
+
+    assert allocator.take() is None
+    assert allocator.next_ids(db, 3) == [1000, 1001, 1002]
+    assert allocator.next_id(db) == 1003
+    assert allocator.take() == 1004
+    assert allocator.next_ids(db, 7) == list(range(1005, 1012))
+
+    assert len(db.log) == 2 and all("generate_series" in sql for sql in db.log)
+
+
+def test_id_allocator_drops_parent_block_after_fork(tbc, monkeypatch):
+    db = FakeDb()
+    allocator = tbc.tbc_id_allocator(block_size=10)
+    allocator.next_id(db)
+
+    parent_pid = tbc.os.getpid()
+    monkeypatch.setattr(tbc.os, "getpid", lambda: parent_pid + 1)
+
+    assert allocator.take() is None
+    assert allocator.next_id(db) == 1010
+
+
+def _wait_refreshed(cache):
+    for _ in range(200):
+        with cache._lock:
+            if not cache._refreshing:
+                return
+        time.sleep(0.01)
+    raise AssertionError("background refresh did not finish")
+
+
+def test_lookup_cache_ttl_and_background_refresh(tbc, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(tbc.time, "monotonic", lambda: now[0])
+    cache = tbc.tbc_lookup_cache(ttl=60)
+    db = FakeDb()
+
+    assert cache.active_pool(db) == "pool1"
+    assert cache.location(db, 1000) == "loc1"
+    assert len(db.log) == 2
+
+    now[0] = 30.0
+    cache.active_pool(db)
+    assert len(db.log) == 2
+
+    FakeDb.instances = 0
+    db.active_pool = "stale"
+    now[0] = 61.0
+    assert cache.active_pool(db) in ("pool1", "stale")
+    _wait_refreshed(cache)
+    # refreshed through a new connection of the caller's db class, not the module-level pgdb
+    assert FakeDb.instances == 1
+    assert cache.active_pool(db) == "pool1"
+    assert len(db.log) == 2
+
+
+def test_lookup_cache_failed_refresh_backs_off(tbc, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(tbc.time, "monotonic", lambda: now[0])
+    cache = tbc.tbc_lookup_cache(ttl=60)
+
+    class BrokenDb(FakeDb):
+        def __enter__(self):
+            raise ConnectionError("refused")
+
+    db = BrokenDb()
+    cache.active_pool(db)
+    now[0] = 61.0
+    cache.active_pool(db)
+    _wait_refreshed(cache)
+    threads = threading.active_count()
+
+    cache.active_pool(db)
+    assert not cache._refreshing
+    assert threading.active_count() == threads
+
+
+def test_lookup_cache_location_miss_falls_back_to_query(tbc):
+    cache = tbc.tbc_lookup_cache()
+    db = FakeDb()
+    cache.active_pool(db)
+    db.locations[2000] = "loc2"
+
+    assert cache.location(db, 2000) == "loc2"
+    assert cache.location(db, 2000) == "loc2"
+    assert cache.location(db, 3000) is None
+    assert [sql for sql in db.log if "th=%s" in sql] == ["select location from book_locator where th=%s"] * 2
+
+    cache.invalidate()
+    assert cache.location(db, 2000) == "loc2"
+    assert db.log[-1] == "select th, location from book_locator"
+
+
+def test_detect_many_memoizes_normalized_inputs(tbc):
+    texts = ["Война  и мир", "War and Peace", " Война и мир ", "War and Peace"]
+
+    assert tbc.detect_many(texts, processes=1) == ["russian", "english", "russian", "english"]
+    assert FakeLangDetect.calls == ["Война и мир", "War and Peace"]
+
+    assert tbc.detect_lang("War   and Peace") == "english"
+    assert tbc.detect_many(["Война и мир"], processes=1) == ["russian"]
+    assert len(FakeLangDetect.calls) == 2
+
+
+def test_detect_many_parallel_keeps_order_and_fills_memo(tbc):
+    texts = [f"book {index}" for index in range(6)] + ["книга"]
+
+    assert tbc.detect_many(texts, processes=2, chunksize=2, min_parallel=2) == ["english"] * 6 + ["russian"]
+    # detection ran in the pool; the parent only stores the results
+    assert FakeLangDetect.calls == []
+    assert tbc.detect_many(texts, processes=1) == ["english"] * 6 + ["russian"]
+    assert FakeLangDetect.calls == []
+
+
+def test_lang_input_skips_missing_fields(tbc):
+    assert tbc.lang_input({"title": "Hello", "author": None, "filename": 42}) == " Hello 42"
+    assert tbc.lang_input({"author": None}) == ""
+
+
+def test_import_files_accepts_missing_author(tbc, tmp_path):
+    db = FakeDb()
+    params = [{"import_file": _book_file(tmp_path, "a.pdf"), "md5": "a", "title": "Hello", "author": None}]
+
+    [entry] = tbc.TBC(db).import_files(params, lang_processes=1, hash_processes=1)
+
+    assert entry["status"] == "ok"
+    assert entry["book"]["detected_lang"] == "english"
+
+
+def _book_file(tmp_path, name, data="pdf"):
+    path = tmp_path / "in" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(data)
+    return str(path)
+
+
+def test_import_files_reports_ok_duplicate_and_error(tbc, tmp_path):
+    db = FakeDb()
+    db._add({"id": 1, "md5": "old", "reload": 0})
+    params = [
+        {"import_file": _book_file(tmp_path, "new.pdf", "new"), "title": "Hello"},
+        {"import_file": _book_file(tmp_path, "old.pdf"), "md5": "old"},
+        {"import_file": _book_file(tmp_path, "again.pdf", "new")},
+        {"import_file": str(tmp_path / "missing.pdf"), "md5": "gone"},
+    ]
+
+    report = tbc.TBC(db).import_files(params, lang_processes=1, hash_processes=1)
+
+    assert [entry["status"] for entry in report] == ["ok", "duplicate", "duplicate", "error"]
+    assert report[0]["id"] == 1000 and report[0]["book"]["detected_lang"] == "english"
+    assert report[1]["id"] == 1
+    assert tbc.os.path.isfile(f"{tbc.TBC.storage_base}/pool1/1000/1000/new.pdf")
+    assert ("insert_many", 1) in db.log and db.log.count("commit") == 2
+
+
+def test_import_files_restores_reload_book_in_place(tbc, tmp_path):
+    db = FakeDb()
+    db._add({"id": 1500, "md5": "lost", "reload": 1, "locator_id": "pool0"})
+
+    [entry] = tbc.TBC(db).import_files(
+        [{"import_file": _book_file(tmp_path, "lost.pdf"), "md5": "lost"}], lang_processes=1, hash_processes=1
+    )
+
+    assert entry["status"] == "ok" and entry["id"] == 1500
+    assert db.books[1500]["reload"] == 0
+    assert tbc.os.path.isfile(f"{tbc.TBC.storage_base}/pool0/1000/1500/lost.pdf")
+    assert "delete from books_images where tbc_id = any(%s)" in db.log
+    assert not any(isinstance(item, tuple) for item in db.log)
+
+
+def test_import_files_cleans_up_failed_placements(tbc, tmp_path):
+    db = FakeDb()
+    db._add({"id": 1500, "md5": "lost", "reload": 1, "locator_id": "pool0"})
+    missing_cover = str(tmp_path / "no-cover.jpg")
+    params = [
+        {"import_file": _book_file(tmp_path, "a.pdf"), "md5": "a", "cover_file": missing_cover},
+        {"import_file": _book_file(tmp_path, "b.pdf"), "md5": "b"},
+        {"import_file": _book_file(tmp_path, "lost.pdf"), "md5": "lost", "cover_file": missing_cover},
+    ]
+
+    report = tbc.TBC(db).import_files(params, lang_processes=1, hash_processes=1)
+
+    assert [entry["status"] for entry in report] == ["error", "ok", "error"]
+    assert "no-cover.jpg" in report[0]["error"]
+    assert report[0]["id"] not in db.books
+    assert report[1]["id"] in db.books
+    assert db.books[1500]["reload"] == 1
+    assert "delete from books_images where tbc_id = any(%s)" not in db.log
+
+
+def test_import_files_falls_back_to_single_imports(tbc, tmp_path):
+    db = FakeDb()
+    db.fail_insert_many = True
+    params = [
+        {"import_file": _book_file(tmp_path, "a.pdf"), "md5": "a"},
+        {"import_file": _book_file(tmp_path, "b.pdf"), "md5": "b"},
+    ]
+
+    report = tbc.TBC(db).import_files(params, lang_processes=1, hash_processes=1)
+
+    assert [entry["status"] for entry in report] == ["ok", "ok"]
+    assert "rollback" in db.log
+    assert sorted(db.books) == [entry["id"] for entry in report]
+    assert sum(1 for sql in db.log if isinstance(sql, str) and sql.startswith("insert into books")) == 2
+
+
+def test_import_files_marks_file_vanished_before_insert(tbc, tmp_path, monkeypatch):
+    db = FakeDb()
+    gone = _book_file(tmp_path, "gone.pdf")
+    params = [{"import_file": gone, "md5": "gone"}, {"import_file": _book_file(tmp_path, "b.pdf"), "md5": "b"}]
+    getsize = tbc.os.path.getsize
+
+    def vanishing_getsize(path):
+        if path == gone:
+            raise FileNotFoundError(path)
+        return getsize(path)
+
+    monkeypatch.setattr(tbc.os.path, "getsize", vanishing_getsize)
+
+    report = tbc.TBC(db).import_files(params, lang_processes=1, hash_processes=1)
+
+    assert [entry["status"] for entry in report] == ["error", "ok"]
+    assert gone in report[0]["error"]
+    assert [book["md5"] for book in db.books.values()] == ["b"]
+
+
+def test_import_files_rolls_back_unexpected_errors(tbc, tmp_path, monkeypatch):
+    db = FakeDb()
+
+    def broken_allocator(db, n):
+        raise RuntimeError("sequence unavailable")
+
+    importer = tbc.TBC(db)
+    monkeypatch.setattr(importer.id_allocator, "next_ids", broken_allocator)
+
+    with pytest.raises(RuntimeError, match="sequence unavailable"):
+        importer.import_files([{"import_file": _book_file(tmp_path, "a.pdf"), "md5": "a"}],
+                              lang_processes=1, hash_processes=1)
+    assert db.log[-1] == "rollback"
+
+
+def test_timing_stats_percentiles(tbc):
+    stats = tbc.timing_stats(max_samples=100)
+    for value in range(1, 101):
+        stats.add({"insert": value / 1000})
+    stats.add({"placement": 0.5})
+
+    percentiles = stats.percentiles()
+
+    assert percentiles["insert"] == {"count": 100, "max": 0.1, "p50": 0.05, "p90": 0.09, "p99": 0.099}
+    assert percentiles["placement"]["p50"] == percentiles["placement"]["max"] == 0.5
+
+    stats.add({"insert": 1.0})
+    assert stats.percentiles()["insert"]["count"] == 101
+    assert stats.percentiles()["insert"]["p50"] == 0.051
+
+    stats.reset()
+    assert stats.percentiles() == {}
+
+
+def test_import_file_records_stage_timings(tbc, tmp_path):
+    db = FakeDb()
+    importer = tbc.TBC(db)
+
+    book = importer.import_file({"import_file": _book_file(tmp_path, "one.pdf"), "md5": "one"})
+
+    assert book["id"] == 1000
+    stages = {"reload_check", "id_allocation", "lang_detect", "insert", "placement", "verification", "cleanup"}
+    assert set(importer.last_timings) == stages
+    assert set(tbc.TBC.timings.percentiles()) == stages
+    assert tbc.TBC.timings.percentiles()["insert"]["count"] == 1
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+
+from app import create_worker_app
+from app.config import Config
+from app.extensions import get_celery_app, get_engine
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time of app.celery_app, in microseconds; generous enough for slow CI.
+IMPORT_BUDGET_US = 1_500_000
+
+FORBIDDEN_PREFIXES = ("sqlalchemy", "app.blueprints.groups", "app.blueprints.types", "app.blueprints.ui", "app.cli")
+
+
+class WorkerConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite+pysqlite:///:memory:"
+
+
+def _import_times(module: str) -> dict[str, int]:
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times: dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_celery_app_import_is_lean_and_within_budget():
+    times = _import_times("app.celery_app")
+
+    heavy = sorted(name for name in times if name.startswith(FORBIDDEN_PREFIXES))
+    assert heavy == []
+    assert times["app.celery_app"] < IMPORT_BUDGET_US
+
+
+def test_worker_app_defers_sqlalchemy_engine():
+    app = create_worker_app(WorkerConfig())
+
+    assert "app.tasks.importer.process_batch_with_progress" in get_celery_app(app).tasks
+    assert "sa_engine" not in app.extensions
+    assert not app.blueprints
+
+    engine = get_engine(app)
+    assert app.extensions["sa_engine"] is engine